@@ -0,0 +1,12 @@
+import os
+
+# config.py читает настройки из окружения при импорте - для бенчмарков хватит заглушек
+os.environ.setdefault("DOMAIN", "localhost")
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:bench-bot-token")
+os.environ.setdefault("AUTH_SECRET_KEY", "bench-secret-key")
+os.environ.setdefault("DB_PROVIDER", "postgresql+asyncpg")
+os.environ.setdefault("DB_HOST", "localhost")
+os.environ.setdefault("DB_PORT", "5432")
+os.environ.setdefault("DB_USER", "postgres")
+os.environ.setdefault("DB_PASSWORD", "postgres")
+os.environ.setdefault("DB_NAME", "ar_api_bench")
@@ -0,0 +1,43 @@
+# Накладные расходы авторизации на один запрос с кешем проверенных токенов и без него.
+# Запуск: python -m benchmarks.bench_auth [--requests 50000] [--users 100]
+import argparse
+import asyncio
+import time
+
+from benchmarks import _env  # noqa: F401
+from fastapi.security import HTTPAuthorizationCredentials
+
+from depends import get_current_user
+from schemas.auth import TokenData
+from services.auth_service import AuthService, create_token_cache
+
+
+async def run(auth_service: AuthService, tokens: list[str], requests: int) -> float:
+    credentials = [HTTPAuthorizationCredentials(scheme="Bearer", credentials=t) for t in tokens]
+    started = time.perf_counter()
+    for i in range(requests):
+        await get_current_user(auth_service=auth_service, token=credentials[i % len(credentials)])
+    return (time.perf_counter() - started) / requests
+
+
+async def main(requests: int, users: int) -> None:
+    issuer = AuthService()
+    tokens = [
+        (await issuer.create_tokens(TokenData(user_id=i, telegram_id=10_000 + i))).access_token
+        for i in range(users)
+    ]
+    without_cache = await run(AuthService(), tokens, requests)
+    with_cache = await run(AuthService(token_cache=create_token_cache()), tokens, requests)
+
+    print(f"requests={requests} users={users}")
+    print(f"without cache: {without_cache * 1e6:8.2f} us/request")
+    print(f"with cache:    {with_cache * 1e6:8.2f} us/request")
+    print(f"speedup:       {without_cache / with_cache:8.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=50_000)
+    parser.add_argument("--users", type=int, default=100)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.users))
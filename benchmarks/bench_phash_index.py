@@ -0,0 +1,51 @@
+# Поиск похожих AR-меток при загрузке, как в MediaUseCase.__find_similar_markers: индекс строится
+# из хешей коллекции, затем для каждого фото загрузки - nearest и add (фото сверяются и друг с другом).
+# Запуск: python -m benchmarks.bench_phash_index [--sizes 100 1000 5000 20000] [--batch 1 50 500]
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks import _env  # noqa: F401
+
+from services.perceptual_hash import PhashIndex
+
+
+def random_hashes(rng: np.random.Generator, size: int) -> list[int]:
+    return rng.integers(np.iinfo(np.int64).min, np.iinfo(np.int64).max, size=size, dtype=np.int64).tolist()
+
+
+def bench(size: int, batch: int, repeats: int) -> tuple[float, float]:
+    rng = np.random.default_rng(size)
+    # Строки из get_marker_hashes: (uuid блока, хеш)
+    rows = list(zip(range(size), random_hashes(rng, size)))
+    batches = [random_hashes(rng, batch) for _ in range(repeats)]
+
+    build = check = 0.0
+    for phashes in batches:
+        started = time.perf_counter()
+        index = PhashIndex((value for _, value in rows), (block_uuid for block_uuid, _ in rows))
+        built = time.perf_counter()
+        for i, value in enumerate(phashes):
+            index.nearest(value)
+            index.add(value, i)
+        check += time.perf_counter() - built
+        build += built - started
+    return build / repeats, check / repeats
+
+
+def main(sizes: list[int], batches: list[int], repeats: int) -> None:
+    print(f"{'blocks':>8} {'batch':>6} {'build ms':>9} {'batch ms':>9} {'photo us':>9}")
+    for size in sizes:
+        for batch in batches:
+            build, check = bench(size, batch, repeats)
+            print(f"{size:>8} {batch:>6} {build * 1000:9.3f} {check * 1000:9.3f} {check / batch * 1e6:9.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 5000, 20000])
+    parser.add_argument("--batch", type=int, nargs="+", default=[1, 50, 500], help="фото в одной загрузке")
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+    main(args.sizes, args.batch, args.repeats)
@@ -0,0 +1,77 @@
+# Стоимость одной строки при отдаче коллекции из --blocks медиа-блоков (без базы, строки генерируются):
+#   orm        - ORM-объекты, from_orm, повторная валидация ответа и jsonable_encoder, как делал FastAPI
+#   projection - строки колонок, model_construct и сериализация сразу в JSON-байты (ModelResponse)
+# Запуск: python -m benchmarks.bench_projection [--blocks 1000] [--iterations 200]
+import argparse
+import json
+import time
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from benchmarks import _env  # noqa: F401
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from db.models import MediaBlock
+from routers.responses import ModelResponse
+from schemas.media_collections import MediaBlock as MediaBlockSchema, MediaBlocksPage
+
+BlockRow = namedtuple("BlockRow", "uuid photo_url video_url created_at")
+
+
+def make_rows(count: int) -> list[BlockRow]:
+    now = datetime.now()
+    return [
+        BlockRow(
+            uuid.uuid4(), f"https://localhost/cdn/{i:064x}.jpg",
+            f"https://localhost/cdn/{i:064x}.mp4", now - timedelta(seconds=i)
+        )
+        for i in range(count)
+    ]
+
+
+def render_orm(rows: list[BlockRow]) -> bytes:
+    blocks = [
+        MediaBlock(uuid=row.uuid, photo_url=row.photo_url, video_url=row.video_url, created_at=row.created_at)
+        for row in rows
+    ]
+    page = MediaBlocksPage(items=[MediaBlockSchema.from_orm(b) for b in blocks])
+    adapter = TypeAdapter(MediaBlocksPage)
+    content = adapter.dump_python(adapter.validate_python(page, from_attributes=True), mode="json", by_alias=True)
+    return json.dumps(jsonable_encoder(content), ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def render_projection(rows: list[BlockRow]) -> bytes:
+    construct_block = MediaBlockSchema.model_construct
+    page = MediaBlocksPage.model_construct(
+        items=[construct_block(id=row.uuid, photo_url=row.photo_url, video_url=row.video_url) for row in rows],
+        next_cursor=None
+    )
+    return ModelResponse(page).body
+
+
+def bench(render, rows: list[BlockRow], iterations: int) -> tuple[float, int]:
+    body = render(rows)
+    started = time.perf_counter()
+    for _ in range(iterations):
+        render(rows)
+    return (time.perf_counter() - started) / iterations, len(body)
+
+
+def main(blocks: int, iterations: int) -> None:
+    rows = make_rows(blocks)
+    assert json.loads(render_orm(rows)) == json.loads(render_projection(rows))
+    print(f"{'path':<11} {'ms/page':>9} {'us/row':>8} {'bytes':>9}")
+    for name, render in (("orm", render_orm), ("projection", render_projection)):
+        seconds, size = bench(render, rows, iterations)
+        print(f"{name:<11} {seconds * 1000:9.3f} {seconds / blocks * 1e6:8.2f} {size:9d}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--blocks", type=int, default=1000)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+    main(args.blocks, args.iterations)
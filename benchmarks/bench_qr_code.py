@@ -0,0 +1,31 @@
+# Сравнение бэкендов и форматов QR-кода: время рендера одного кода и размер результата.
+# Запуск: python -m benchmarks.bench_qr_code [--iterations 200]
+import argparse
+import time
+
+from benchmarks import _env  # noqa: F401
+
+from services.qr_code_service import RENDERERS
+
+
+def bench(render, payload: str, image_format: str, iterations: int) -> tuple[float, int]:
+    render(payload, image_format)
+    started = time.perf_counter()
+    for i in range(iterations):
+        data = render(f'{payload}{i}', image_format)
+    return (time.perf_counter() - started) / iterations, len(data)
+
+
+def main(iterations: int) -> None:
+    payload = "https://t.me/ar_bot/app?startapp=collection|6f1c2f0e-8d8a-4d53-9f57-2a1c0b6e4f10"
+    print(f"{'backend':<8} {'format':<6} {'ms/code':>9} {'bytes':>8}")
+    for backend, render in RENDERERS.items():
+        for image_format in ("png", "svg"):
+            seconds, size = bench(render, payload, image_format, iterations)
+            print(f"{backend:<8} {image_format:<6} {seconds * 1000:9.3f} {size:8d}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=200)
+    main(parser.parse_args().iterations)
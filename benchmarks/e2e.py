@@ -0,0 +1,243 @@
+# Сквозной бенчмарк горячих эндпоинтов: приложение работает в этом же процессе через ASGI-клиент,
+# база - тестовая БД Postgres из переменных DB_* (таблицы пересоздаются!), файлы - во временном каталоге.
+#
+# Запуск:
+#   pip install -r benchmarks/requirements.txt
+#   DB_NAME=ar_api_bench python -m benchmarks.e2e --update-baselines   # записать базовые значения на этой машине
+#   DB_NAME=ar_api_bench python -m benchmarks.e2e                      # сравнить с baselines.json
+#
+# Базовые значения зависят от машины, поэтому baselines.json записывается на стенде, где гоняется сравнение.
+# Код возврата 1, если какой-то сценарий хуже базового значения больше чем на --tolerance,
+# а также если baselines.json нет или в нем нет какого-то сценария: без базы сравнение ничего не проверяет.
+import argparse
+import asyncio
+import hashlib
+import hmac
+import io
+import json
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, asdict
+from typing import Awaitable, Callable
+from urllib.parse import urlencode
+
+from benchmarks import _env  # noqa: F401
+
+import httpx
+import numpy as np
+from PIL import Image
+
+from config import settings
+from db.main import async_engine
+from db.models.base import Base
+from main import create_app
+from services.file_storage import FileStorageService
+from services.telegram_auth import get_secret_key
+
+BASELINES_PATH = os.path.join(os.path.dirname(__file__), "baselines.json")
+
+# Сигнатура mp4 + тело: видео не декодируется, достаточно прохождения проверки формата.
+# Уникальный префикс на каждую загрузку, чтобы дедупликация не искажала запись
+MP4_HEAD = b"\x00\x00\x00\x20ftypisom\x00\x00\x02\x00"
+
+
+@dataclass
+class ScenarioResult:
+    name: str
+    requests: int
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    throughput_rps: float
+
+
+def make_photo(seed: int, size: int) -> bytes:
+    # Настоящий JPEG, который проходит весь конвейер: крупные случайные блоки дают углы для AR-признаков,
+    # а свой узор и шум на каждую загрузку - разные sha256 и pHash (дедупликация и проверка похожих меток не срабатывают)
+    rng = np.random.default_rng(seed)
+    width, height = size, size * 3 // 4
+    blocks = rng.integers(0, 256, (height // 32, width // 32, 3), dtype=np.uint8)
+    pixels = np.asarray(Image.fromarray(blocks).resize((width, height), Image.Resampling.NEAREST), dtype=np.int16)
+    pixels += rng.integers(-12, 13, pixels.shape, dtype=np.int16)
+    f = io.BytesIO()
+    Image.fromarray(pixels.clip(0, 255).astype(np.uint8)).save(f, format="JPEG", quality=90)
+    return f.getvalue()
+
+
+def make_init_data(telegram_id: int) -> str:
+    user = json.dumps(dict(
+        id=telegram_id, first_name="Bench", last_name=str(telegram_id), username=f"bench{telegram_id}",
+        language_code="ru", allows_write_to_pm=True
+    ), separators=(",", ":"))
+    vals = {"auth_date": str(int(time.time())), "query_id": f"bench-{telegram_id}", "user": user}
+    data_check_string = "\n".join(f"{k}={v}" for k, v in sorted(vals.items()))
+    vals["hash"] = hmac.new(
+        get_secret_key(settings.telegram_bot_token), data_check_string.encode(), hashlib.sha256
+    ).hexdigest()
+    return urlencode(vals)
+
+
+async def run_scenario(name: str, requests: int, concurrency: int,
+                       call: Callable[[int], Awaitable[httpx.Response]]) -> ScenarioResult:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+
+    async def one(i: int) -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            response = await call(i)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                raise RuntimeError(f"{name}: {response.status_code} {response.text[:200]}")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - started
+
+    quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return ScenarioResult(
+        name=name, requests=requests,
+        p50_ms=round(quantiles[49] * 1000, 2), p95_ms=round(quantiles[94] * 1000, 2),
+        p99_ms=round(quantiles[98] * 1000, 2), throughput_rps=round(requests / elapsed, 2)
+    )
+
+
+def check_database_target(allow_drop: bool) -> bool:
+    # Таблицы пересоздаются: без явного флага - только на базах, которые по имени тестовые
+    database = settings.db
+    dsn = f'{database.provider}://{database.user}@{database.host}:{database.port}/{database.name}'
+    if not allow_drop and not any(marker in database.name.lower() for marker in ("bench", "test")):
+        print(f"refusing to drop tables in {dsn}: DB_NAME must contain 'bench' or 'test', "
+              f"or pass --yes-drop-tables", file=sys.stderr)
+        return False
+    print(f"dropping and recreating tables in {dsn}")
+    return True
+
+
+async def prepare_database() -> None:
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+
+
+async def run(args) -> tuple[list[ScenarioResult], float]:
+    await prepare_database()
+    # Фото готовятся заранее: кодирование JPEG не должно попадать в замер
+    photos = [make_photo(i, args.photo_px) for i in range(args.uploads)]
+    video_body = os.urandom(args.video_kb * 1024)
+
+    transport = httpx.ASGITransport(app=create_app())
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        results = []
+
+        results.append(await run_scenario(
+            "auth_create_tokens", args.requests, args.concurrency,
+            lambda i: client.post("/auth/create_tokens", json={"init_data": make_init_data(1_000_000 + i)})
+        ))
+
+        tokens = (await client.post(
+            "/auth/create_tokens", json={"init_data": make_init_data(42)}
+        )).json()
+        auth = {"Authorization": f"Bearer {tokens['access_token']}"}
+
+        collection_ids: list[str] = []
+
+        async def create_collection(i: int) -> httpx.Response:
+            response = await client.post("/collections", json={"name": f"bench {i}"}, headers=auth)
+            collection_ids.append(response.json()["uuid"])
+            return response
+
+        results.append(await run_scenario("create_collection", args.requests, args.concurrency, create_collection))
+        collection_id = collection_ids[0]
+
+        results.append(await run_scenario(
+            "add_media_block", args.uploads, args.concurrency,
+            lambda i: client.post(
+                f"/collections/{collection_id}/media_blocks", headers=auth,
+                files={
+                    "photo": ("photo.jpg", photos[i], "image/jpeg"),
+                    "video": ("video.mp4", MP4_HEAD + i.to_bytes(8, "big") + video_body, "video/mp4"),
+                }
+            )
+        ))
+
+        results.append(await run_scenario(
+            "get_collection", args.requests, args.concurrency,
+            lambda i: client.get(f"/collections/{collection_id}")
+        ))
+        results.append(await run_scenario(
+            "my_collections", args.requests, args.concurrency,
+            lambda i: client.get("/collections/my", params={"limit": 20}, headers=auth)
+        ))
+
+    await async_engine.dispose()
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return results, round(peak_rss_mb, 1)
+
+
+def compare(results: list[ScenarioResult], peak_rss_mb: float, baselines: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for result in results:
+        baseline = baselines.get("scenarios", {}).get(result.name)
+        if not baseline:
+            regressions.append(f'{result.name}: no baseline, run with --update-baselines')
+            continue
+        if result.p95_ms > baseline["p95_ms"] * (1 + tolerance):
+            regressions.append(f'{result.name}: p95 {result.p95_ms} ms > baseline {baseline["p95_ms"]} ms')
+        if result.throughput_rps < baseline["throughput_rps"] * (1 - tolerance):
+            regressions.append(
+                f'{result.name}: throughput {result.throughput_rps} rps < baseline {baseline["throughput_rps"]} rps'
+            )
+    if "peak_rss_mb" in baselines and peak_rss_mb > baselines["peak_rss_mb"] * (1 + tolerance):
+        regressions.append(f'peak RSS {peak_rss_mb} MB > baseline {baselines["peak_rss_mb"]} MB')
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Сквозной бенчмарк горячих эндпоинтов")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--uploads", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--photo-px", type=int, default=2048, help="ширина фото, высота - 3/4 ширины")
+    parser.add_argument("--video-kb", type=int, default=30 * 1024)
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--update-baselines", action="store_true")
+    parser.add_argument("--yes-drop-tables", action="store_true",
+                        help="пересоздать таблицы, даже если имя базы не похоже на тестовое")
+    args = parser.parse_args()
+    if not check_database_target(args.yes_drop_tables):
+        return 2
+
+    with tempfile.TemporaryDirectory(prefix="ar_api_cdn_") as cdn_dir:
+        FileStorageService.dir_path = cdn_dir
+        results, peak_rss_mb = asyncio.run(run(args))
+
+    print(f"{'scenario':<20} {'n':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'rps':>9}")
+    for r in results:
+        print(f"{r.name:<20} {r.requests:>5} {r.p50_ms:>9} {r.p95_ms:>9} {r.p99_ms:>9} {r.throughput_rps:>9}")
+    print(f"peak RSS: {peak_rss_mb} MB")
+
+    if args.update_baselines:
+        with open(BASELINES_PATH, "w") as f:
+            json.dump(dict(
+                scenarios={r.name: asdict(r) for r in results}, peak_rss_mb=peak_rss_mb
+            ), f, indent=2)
+        print(f"baselines written to {BASELINES_PATH}")
+        return 0
+
+    if not os.path.exists(BASELINES_PATH):
+        print(f"REGRESSION no {BASELINES_PATH}, run with --update-baselines to record one", file=sys.stderr)
+        return 1
+    with open(BASELINES_PATH) as f:
+        regressions = compare(results, peak_rss_mb, json.load(f), args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
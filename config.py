@@ -13,27 +13,175 @@ class DatabaseSettings(BaseSettings):
     user: str
     password: str
     name: str
+    echo: bool = False
+    pool_size: int = 10
+    max_overflow: int = 20
+    pool_timeout: float = 30
+    pool_recycle: int = 1800
+    pool_pre_ping: bool = True
+    statement_cache_size: int = 100
+    replica_hosts: list[str] = []
 
     @property
     def url(self):
         return f'{self.provider}://{self.user}:{self.password}@{self.host}:{self.port}/{self.name}'
 
+    @property
+    def replica_urls(self) -> list[str]:
+        # Реплики: "host" или "host:port", остальные параметры подключения - как у основной базы
+        urls = []
+        for replica in self.replica_hosts:
+            host, _, port = replica.partition(":")
+            urls.append(f'{self.provider}://{self.user}:{self.password}@{host}:{port or self.port}/{self.name}')
+        return urls
+
+
+class StorageSettings(BaseSettings):
+    max_photo_size: int
+    max_video_size: int
+    chunk_size: int
+    content_addressed: bool
+    upload_concurrency: int
+    max_batch_blocks: int
+    upload_session_ttl: float
+    upload_purge_interval: float
+
+
+class CacheSettings(BaseSettings):
+    backend: str
+    url: str | None
+    ttl: float
+    size: int
+    http_cache_control: str
+
+
+class QrCodeSettings(BaseSettings):
+    backend: str
+    image_format: str
+    executor: str
+    workers: int
+    cache_size: int
+
+
+class MediaGcSettings(BaseSettings):
+    interval: float
+    grace_period: float
+    batch_size: int
+    deletes_per_second: float
+
+
+class PhotoPipelineSettings(BaseSettings):
+    enabled: bool
+    workers: int
+    thumbnail_size: int
+    webp_quality: int
+    jpeg_quality: int
+    max_pixels: int
+    ar_features: bool
+    ar_analysis_size: int
+    ar_max_keypoints: int
+    ar_min_tracking_score: float
+    duplicate_marker_policy: str
+    duplicate_marker_distance: int
+
+
+class ProfilingSettings(BaseSettings):
+    enabled: bool
+    slow_request_ms: float
+    sample_rate: float
+    n_plus_one_threshold: int
+    max_statements: int
+
 
 class Settings(BaseSettings):
     domain: str
     telegram_bot_token: str
+    telegram_init_data_cache_ttl: int
     auth_secret_key: str
+    auth_token_cache_size: int
     db: DatabaseSettings
     media_path: str
+    storage: StorageSettings
+    cache: CacheSettings
+    qr_code: QrCodeSettings
+    media_gc: MediaGcSettings
+    photo_pipeline: PhotoPipelineSettings
+    profiling: ProfilingSettings
+    serve_media: bool
 
 settings = Settings(
     domain=os.getenv("DOMAIN"),
     telegram_bot_token=os.getenv("TELEGRAM_BOT_TOKEN"),
+    telegram_init_data_cache_ttl=int(os.getenv("TELEGRAM_INIT_DATA_CACHE_TTL", 60)),
     auth_secret_key=os.getenv("AUTH_SECRET_KEY"),
+    auth_token_cache_size=int(os.getenv("AUTH_TOKEN_CACHE_SIZE", 10000)),
     db=DatabaseSettings(
         provider=os.getenv("DB_PROVIDER"), host=os.getenv("DB_HOST"),
         port=int(os.getenv("DB_PORT")), user=os.getenv("DB_USER"),
-        password=os.getenv("DB_PASSWORD"), name=os.getenv("DB_NAME")
+        password=os.getenv("DB_PASSWORD"), name=os.getenv("DB_NAME"),
+        echo=os.getenv("DB_ECHO", "0") == "1",
+        pool_size=int(os.getenv("DB_POOL_SIZE", 10)),
+        max_overflow=int(os.getenv("DB_MAX_OVERFLOW", 20)),
+        pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", 30)),
+        pool_recycle=int(os.getenv("DB_POOL_RECYCLE", 1800)),
+        pool_pre_ping=os.getenv("DB_POOL_PRE_PING", "1") == "1",
+        statement_cache_size=int(os.getenv("DB_STATEMENT_CACHE_SIZE", 100)),
+        replica_hosts=[host.strip() for host in os.getenv("DB_REPLICA_HOSTS", "").split(",") if host.strip()]
+    ),
+    media_path=os.path.join(BASE_DIR, "cdn"),
+    storage=StorageSettings(
+        max_photo_size=int(os.getenv("MAX_PHOTO_SIZE", 20 * 1024 * 1024)),
+        max_video_size=int(os.getenv("MAX_VIDEO_SIZE", 300 * 1024 * 1024)),
+        chunk_size=int(os.getenv("UPLOAD_CHUNK_SIZE", 1024 * 1024)),
+        content_addressed=os.getenv("MEDIA_CONTENT_ADDRESSED", "1") == "1",
+        upload_concurrency=int(os.getenv("UPLOAD_CONCURRENCY", 4)),
+        max_batch_blocks=int(os.getenv("MAX_BATCH_BLOCKS", 50)),
+        # Докачка: сессия без новых данных дольше ttl считается брошенной
+        upload_session_ttl=float(os.getenv("UPLOAD_SESSION_TTL", 24 * 3600)),
+        upload_purge_interval=float(os.getenv("UPLOAD_PURGE_INTERVAL", 600))
+    ),
+    cache=CacheSettings(
+        backend=os.getenv("CACHE_BACKEND", "memory"),
+        url=os.getenv("CACHE_URL"),
+        ttl=float(os.getenv("CACHE_TTL", 30)),
+        size=int(os.getenv("CACHE_SIZE", 5000)),
+        # Коллекции публичные: CDN и клиент могут хранить ответ, но перепроверяют его по ETag
+        http_cache_control=os.getenv("COLLECTION_CACHE_CONTROL", "public, no-cache")
+    ),
+    qr_code=QrCodeSettings(
+        backend=os.getenv("QR_CODE_BACKEND", "segno"),
+        image_format=os.getenv("QR_CODE_FORMAT", "png"),
+        executor=os.getenv("QR_CODE_EXECUTOR", "process"),
+        workers=int(os.getenv("QR_CODE_WORKERS", 2)),
+        cache_size=int(os.getenv("QR_CODE_CACHE_SIZE", 1024))
+    ),
+    media_gc=MediaGcSettings(
+        interval=float(os.getenv("MEDIA_GC_INTERVAL", 0)),
+        grace_period=float(os.getenv("MEDIA_GC_GRACE_PERIOD", 3600)),
+        batch_size=int(os.getenv("MEDIA_GC_BATCH_SIZE", 1000)),
+        deletes_per_second=float(os.getenv("MEDIA_GC_DELETES_PER_SECOND", 50))
+    ),
+    photo_pipeline=PhotoPipelineSettings(
+        enabled=os.getenv("PHOTO_PIPELINE", "1") == "1",
+        workers=int(os.getenv("PHOTO_PIPELINE_WORKERS", 2)),
+        thumbnail_size=int(os.getenv("PHOTO_THUMBNAIL_SIZE", 320)),
+        webp_quality=int(os.getenv("PHOTO_WEBP_QUALITY", 80)),
+        jpeg_quality=int(os.getenv("PHOTO_JPEG_QUALITY", 80)),
+        max_pixels=int(os.getenv("PHOTO_MAX_PIXELS", 50_000_000)),
+        ar_features=os.getenv("AR_FEATURES", "1") == "1",
+        ar_analysis_size=int(os.getenv("AR_ANALYSIS_SIZE", 640)),
+        ar_max_keypoints=int(os.getenv("AR_MAX_KEYPOINTS", 500)),
+        ar_min_tracking_score=float(os.getenv("AR_MIN_TRACKING_SCORE", 0.2)),
+        # off | warn | reject
+        duplicate_marker_policy=os.getenv("DUPLICATE_MARKER_POLICY", "warn"),
+        duplicate_marker_distance=int(os.getenv("DUPLICATE_MARKER_DISTANCE", 8))
+    ),
+    profiling=ProfilingSettings(
+        enabled=os.getenv("PROFILING", "0") == "1",
+        slow_request_ms=float(os.getenv("PROFILING_SLOW_REQUEST_MS", 500)),
+        sample_rate=float(os.getenv("PROFILING_SAMPLE_RATE", 0.1)),
+        n_plus_one_threshold=int(os.getenv("PROFILING_N_PLUS_ONE_THRESHOLD", 5)),
+        max_statements=int(os.getenv("PROFILING_MAX_STATEMENTS", 200))
     ),
-    media_path=os.path.join(BASE_DIR, "cdn")
+    serve_media=os.getenv("SERVE_MEDIA", "0") == "1"
 )
\ No newline at end of file
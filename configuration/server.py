@@ -1,5 +1,10 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+from config import settings
 from exceptions.api import register_errors
 from fastapi import FastAPI
+from monitoring.middleware import PrometheusMiddleware, ProfilerMiddleware
 from routers import __routes__
 from starlette.middleware.cors import CORSMiddleware
 
@@ -14,6 +19,7 @@ class Server:
         self.__register_routers(app)
         self.__register_exceptions(app)
         self.__register_openapi_json(app)
+        self.__register_background_tasks(app)
 
     def get_app(self):
         return self.__app
@@ -37,7 +43,7 @@ class Server:
             CORSMiddleware,
             allow_origins=origins,
             allow_credentials=True,
-            allow_methods=["GET", "POST", "OPTIONS", "DELETE", "PATCH", "PUT"],
+            allow_methods=["GET", "HEAD", "POST", "OPTIONS", "DELETE", "PATCH", "PUT"],
             allow_headers=[
                 "Authorization",
                 "Content-Type",
@@ -46,8 +52,21 @@ class Server:
                 "Access-Control-Allow-Origin",
                 "Access-Control-Allow-Headers",
                 "Access-Control-Allow-Methods",
+                "Tus-Resumable",
+                "Upload-Length",
+                "Upload-Offset",
+                "Upload-Metadata",
             ],
+            expose_headers=["Location", "Tus-Resumable", "Upload-Offset", "Upload-Length", "Upload-Expires"],
         )
+        if settings.profiling.enabled:
+            from db.main import async_engine, replica_engines
+            from monitoring.sql_profiler import install_sql_profiler
+            # Чтения идут в реплики - без их движков SQL-время читающих эндпоинтов не попадет в профиль
+            for engine in (async_engine, *replica_engines):
+                install_sql_profiler(engine)
+            app.add_middleware(ProfilerMiddleware)
+        app.add_middleware(PrometheusMiddleware)
 
     @staticmethod
     def __register_exceptions(app):
@@ -62,4 +81,31 @@ class Server:
             print(f'{schema=}')
             return schema
 
-        app.get("/api_game/openapi.json")(get_open_api)
\ No newline at end of file
+        app.get("/api_game/openapi.json")(get_open_api)
+
+    @staticmethod
+    def __register_background_tasks(app: FastAPI):
+        jobs = []
+        if settings.media_gc.interval > 0:
+            from services.media_gc import create_media_garbage_collector
+            jobs.append(lambda: create_media_garbage_collector().run_periodically())
+        if settings.storage.upload_purge_interval > 0:
+            from services.upload_sessions import UploadSessionService
+            jobs.append(lambda: UploadSessionService().run_periodically())
+        if not jobs:
+            return
+
+        # Оборачиваем lifespan роутера: add_event_handler в новых версиях Starlette убран
+        lifespan = app.router.lifespan_context
+
+        @asynccontextmanager
+        async def run_background_tasks(app_):
+            tasks = [asyncio.create_task(job()) for job in jobs]
+            try:
+                async with lifespan(app_) as state:
+                    yield state
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+        app.router.lifespan_context = run_background_tasks
\ No newline at end of file
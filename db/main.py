@@ -1,12 +1,67 @@
+from contextvars import ContextVar
+from itertools import cycle
 from typing import Callable
 
-from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine, AsyncSession
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine, AsyncSession, AsyncEngine
 from config import settings
+from db.pool_metrics import instrumented_pool_class, pools
 
-async_engine = create_async_engine(settings.db.url, echo=True)
+
+def create_engine(url: str, name: str) -> AsyncEngine:
+    db = settings.db
+    connect_args = {}
+    if "asyncpg" in db.provider:
+        connect_args["prepared_statement_cache_size"] = db.statement_cache_size
+    engine = create_async_engine(
+        url,
+        echo=db.echo,
+        poolclass=instrumented_pool_class(name),
+        pool_size=db.pool_size,
+        max_overflow=db.max_overflow,
+        pool_timeout=db.pool_timeout,
+        pool_recycle=db.pool_recycle,
+        pool_pre_ping=db.pool_pre_ping,
+        connect_args=connect_args
+    )
+    pools[name].engine = engine
+    return engine
+
+
+async_engine = create_engine(settings.db.url, name="primary")
 
 async_session = async_sessionmaker(autocommit=False, autoflush=False, bind=async_engine)
 
+replica_engines = [
+    create_engine(url, name=f"replica_{i}") for i, url in enumerate(settings.db.replica_urls)
+]
+replica_sessions = cycle([
+    async_sessionmaker(autocommit=False, autoflush=False, bind=engine) for engine in replica_engines
+])
+
+# После записи в рамках запроса чтения идут в основную базу: реплика может еще не догнать ее
+primary_required: ContextVar[bool] = ContextVar("primary_required", default=False)
+# Все чтения запроса идут в одну реплику, чтобы версия и данные коллекции не разошлись
+current_replica: ContextVar[async_sessionmaker | None] = ContextVar("current_replica", default=None)
+
+
+def mark_primary_required() -> None:
+    primary_required.set(True)
+
+
+def read_sessionmaker() -> async_sessionmaker:
+    # Источник чтений для текущего контекста: основная база после записи или закрепленная за запросом реплика
+    if not replica_engines or primary_required.get():
+        return async_session
+    replica = current_replica.get()
+    if replica is None:
+        replica = next(replica_sessions)
+        current_replica.set(replica)
+    return replica
+
+
+def read_session() -> AsyncSession:
+    return read_sessionmaker()()
+
 
 async def get_db() -> AsyncSession:
     db = async_session()
@@ -22,4 +77,4 @@ def connection(func: Callable):
         async with async_session() as session:
             return await func(session, *args, **kwargs)
 
-    return wrapper
\ No newline at end of file
+    return wrapper
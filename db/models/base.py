@@ -10,4 +10,5 @@ Base = declarative_base()
 
 uuid_pk = Annotated[uuid.UUID, mapped_column(psql.UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)]
 bigInt = Annotated[int, mapped_column(BigInteger)]
-createdAt = Annotated[datetime, mapped_column(server_default=func.now())]
\ No newline at end of file
+createdAt = Annotated[datetime, mapped_column(server_default=func.now())]
+changeVersion = Annotated[int, mapped_column(BigInteger, server_default="0", default=0)]
\ No newline at end of file
@@ -1,5 +1,5 @@
-from db.models.base import Base, uuid_pk, bigInt, createdAt
-from sqlalchemy import Table, ForeignKey
+from db.models.base import Base, uuid_pk, bigInt, createdAt, changeVersion
+from sqlalchemy import Table, ForeignKey, Index, BigInteger
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 
@@ -14,9 +14,15 @@ class Collection(Base):
     qr_code_url: Mapped[str | None]
     telegram_user_id: Mapped[bigInt]
     created_at: Mapped[createdAt]
+    # Растет на 1 при каждом изменении коллекции или ее блоков
+    version: Mapped[changeVersion]
 
     blocks = relationship("MediaBlock", back_populates="collection", order_by="desc(MediaBlock.created_at)")
 
+    __table_args__ = (
+        Index("ix_collections_telegram_user_id_created_at", "telegram_user_id", "created_at"),
+    )
+
 
 class MediaBlock(Base):
     __tablename__ = "media_blocks"
@@ -24,7 +30,32 @@ class MediaBlock(Base):
     uuid: Mapped[uuid_pk]
     photo_url: Mapped[str]
     video_url: Mapped[str]
+    photo_thumbnail_url: Mapped[str | None]
+    photo_webp_url: Mapped[str | None]
+    features_url: Mapped[str | None]
+    tracking_score: Mapped[float | None]
+    photo_phash: Mapped[int | None] = mapped_column(BigInteger)
     collection_uuid: Mapped[str] = mapped_column(ForeignKey(Collection.uuid))
     created_at: Mapped[createdAt]
+    # Версия коллекции, в которой блок добавлен или изменен последний раз
+    updated_version: Mapped[changeVersion]
+
+    collection = relationship(Collection, foreign_keys=collection_uuid)
+
+    __table_args__ = (
+        Index("ix_media_blocks_collection_uuid_created_at", "collection_uuid", "created_at"),
+        Index("ix_media_blocks_collection_uuid_updated_version", "collection_uuid", "updated_version"),
+    )
+
+
+class MediaBlockTombstone(Base):
+    # Удаленные блоки: по ним синхронизация сообщает клиенту, что блок нужно убрать
+    __tablename__ = "media_block_tombstones"
+
+    block_uuid: Mapped[uuid_pk]
+    collection_uuid: Mapped[str] = mapped_column(ForeignKey(Collection.uuid, ondelete="CASCADE"))
+    deleted_version: Mapped[bigInt]
 
-    collection = relationship(Collection, foreign_keys=collection_uuid)
\ No newline at end of file
+    __table_args__ = (
+        Index("ix_media_block_tombstones_collection_uuid_deleted_version", "collection_uuid", "deleted_version"),
+    )
\ No newline at end of file
@@ -9,5 +9,6 @@ class User(Base):
 
     id: Mapped[int] = mapped_column(primary_key=True)
     telegram_id: Mapped[bigInt] = mapped_column(unique=True)
+    username: Mapped[str | None]
     full_name: Mapped[str]
     created_at: Mapped[createdAt]
\ No newline at end of file
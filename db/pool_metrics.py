@@ -0,0 +1,67 @@
+import time
+
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+
+class PoolMetrics:
+    def __init__(self, name: str):
+        self.name = name
+        self.engine: AsyncEngine | None = None
+        self.checkouts = 0
+        self.checkout_wait_seconds_total = 0.0
+        self.checkout_wait_seconds_max = 0.0
+        self.overflow_events = 0
+        self.checkout_timeouts = 0
+
+    def observe_checkout(self, wait: float, overflowed: bool) -> None:
+        self.checkouts += 1
+        self.checkout_wait_seconds_total += wait
+        if wait > self.checkout_wait_seconds_max:
+            self.checkout_wait_seconds_max = wait
+        if overflowed:
+            self.overflow_events += 1
+
+    def snapshot(self) -> dict:
+        pool = self.engine.pool if self.engine else None
+        return dict(
+            name=self.name,
+            size=pool.size() if pool else 0,
+            checked_out=pool.checkedout() if pool else 0,
+            idle=pool.checkedin() if pool else 0,
+            overflow=max(pool.overflow(), 0) if pool else 0,
+            checkouts=self.checkouts,
+            checkout_wait_seconds_total=self.checkout_wait_seconds_total,
+            checkout_wait_seconds_max=self.checkout_wait_seconds_max,
+            overflow_events=self.overflow_events,
+            checkout_timeouts=self.checkout_timeouts,
+        )
+
+
+class InstrumentedAsyncAdaptedQueuePool(AsyncAdaptedQueuePool):
+    # Считает время ожидания свободного соединения и выходы за pool_size
+    metrics: PoolMetrics
+
+    def _do_get(self):
+        overflow = self.overflow()
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.metrics.checkout_timeouts += 1
+            raise
+        self.metrics.observe_checkout(
+            wait=time.perf_counter() - started,
+            overflowed=self.overflow() > max(overflow, 0)
+        )
+        return connection
+
+
+pools: dict[str, PoolMetrics] = {}
+
+
+def instrumented_pool_class(name: str) -> type[InstrumentedAsyncAdaptedQueuePool]:
+    # Метрики - атрибут класса, а не экземпляра: engine.dispose() пересоздает пул тем же классом
+    metrics = pools[name] = PoolMetrics(name)
+    return type("InstrumentedAsyncAdaptedQueuePool", (InstrumentedAsyncAdaptedQueuePool,), {"metrics": metrics})
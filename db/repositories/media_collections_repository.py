@@ -1,13 +1,15 @@
-from typing import Protocol
-from uuid import UUID
+from typing import Protocol, AsyncIterator
+from uuid import UUID, uuid4
 
 from db.main import async_session
+from db.repositories.pagination import encode_cursor, decode_cursor
 from exceptions.core import EntityNotFound
-from schemas.media_collections import CollectionResponse, CreatedCollectionResponse, MediaBlock as MediaBlockSchema
-from sqlalchemy import select, insert, delete, update
-from db.models import MediaBlock, Collection
+from schemas.media_collections import CollectionResponse, CreatedCollectionResponse, MediaBlock as MediaBlockSchema, \
+    CollectionsPage, MediaBlocksPage, CollectionChanges
+from sqlalchemy import select, insert, delete, update, tuple_, true, Row, union_all
+from db.models import MediaBlock, Collection, MediaBlockTombstone
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload, load_only
+from sqlalchemy.orm import selectinload, aliased
 
 
 class MediaCollectionsRepositoryProtocol(Protocol):
@@ -18,15 +20,31 @@ class MediaCollectionsRepositoryProtocol(Protocol):
         ...
 
     async def get_collections_by_user(self, telegram_user_id: int,
-                                      offset: int | None = None, limit: int | None = None) -> list[CollectionResponse]:
+                                      offset: int | None = None, limit: int | None = None,
+                                      cursor: str | None = None,
+                                      blocks_per_collection: int | None = None) -> CollectionsPage:
         ...
 
-    async def get_collection_media_block(self, collection_uuid: UUID) -> list[MediaBlockSchema]:
+    async def get_collection_media_block(self, collection_uuid: UUID,
+                                         limit: int | None = None, cursor: str | None = None) -> MediaBlocksPage:
+        ...
+
+    async def get_collection_changes(self, collection_uuid: UUID, since: int = 0) -> CollectionChanges:
+        ...
+
+    async def get_collection_version(self, collection_uuid: UUID) -> int:
         ...
 
     async def get_media_block(self, media_block_uuid: UUID) -> MediaBlockSchema:
         ...
 
+    def iter_media_urls(self, batch_size: int = 1000) -> AsyncIterator[str]:
+        ...
+
+    async def get_marker_hashes(self, collection_uuid: UUID | None = None,
+                                media_block_uuid: UUID | None = None) -> list[tuple[UUID, int]]:
+        ...
+
     async def create_collection(self, name: str, telegram_user_id: int,
                                 startup_url: str | None = None, qr_code_url: str | None = None) -> UUID:
         ...
@@ -36,17 +54,22 @@ class MediaCollectionsRepositoryProtocol(Protocol):
         ...
 
     async def add_media_block_to_collection(self, collection_uuid: UUID, photo_url: str,
-                                            video_url: str, telegram_user_id: int) -> UUID:
+                                            video_url: str, telegram_user_id: int,
+                                            derivatives: dict[str, str | None] | None = None) -> UUID:
+        ...
+
+    async def add_media_blocks_to_collection(self, collection_uuid: UUID, blocks: list[dict[str, str | None]],
+                                             telegram_user_id: int) -> list[UUID]:
         ...
 
     async def delete_collection(self, collection_uuid: UUID, telegram_user_id: int) -> None:
         ...
 
-    async def delete_media_block(self, media_block_uuid: UUID, telegram_user_id: int) -> None:
+    async def delete_media_block(self, media_block_uuid: UUID, telegram_user_id: int) -> UUID:
         ...
 
     async def update_media_block(self, media_block_uuid: UUID, telegram_user_id: int,
-                                 updates: dict) -> None:
+                                 updates: dict) -> UUID:
         ...
 
     async def update_collection_name(self, collection_uuid: UUID, telegram_user_id: int,
@@ -58,57 +81,231 @@ class MediaCollectionRepository(MediaCollectionsRepositoryProtocol):
     def __init__(self, session: AsyncSession):
         self.session = session
 
+    @staticmethod
+    def _blocks_lateral(collection_uuid, offset: int | None = None, limit: int | None = None):
+        # Первые limit блоков каждой коллекции: LATERAL-подзапрос идет по индексу
+        # (collection_uuid, created_at) и останавливается, набрав limit строк
+        return (
+            select(
+                MediaBlock.uuid, MediaBlock.photo_url, MediaBlock.video_url,
+                MediaBlock.photo_thumbnail_url, MediaBlock.photo_webp_url,
+                MediaBlock.features_url, MediaBlock.tracking_score, MediaBlock.created_at
+            )
+            .where(MediaBlock.collection_uuid == collection_uuid)
+            .order_by(MediaBlock.created_at.desc(), MediaBlock.uuid.desc())
+            .offset(offset or None)
+            .limit(limit)
+            .lateral("blocks")
+        )
+
+    @staticmethod
+    def _group_collection_rows(rows: list[Row]) -> list[CollectionResponse]:
+        # Строки (коллекция, блок) идут подряд по коллекциям, у коллекции без блоков block_uuid = None.
+        # Значения пришли из базы с нужными типами, поэтому схемы собираются через model_construct без валидации
+        collections: dict[UUID, CollectionResponse] = {}
+        construct_block = MediaBlockSchema.model_construct
+        for row in rows:
+            collection = collections.get(row.uuid)
+            if collection is None:
+                collection = collections[row.uuid] = CollectionResponse.model_construct(
+                    id=row.uuid, name=row.name,
+                    startup_url=row.startup_url, qr_code_url=row.qr_code_url, blocks=[]
+                )
+            if row.block_uuid is not None:
+                collection.blocks.append(construct_block(
+                    id=row.block_uuid, photo_url=row.photo_url, video_url=row.video_url,
+                    photo_thumbnail_url=row.photo_thumbnail_url, photo_webp_url=row.photo_webp_url,
+                    features_url=row.features_url, tracking_score=row.tracking_score
+                ))
+        return list(collections.values())
+
     async def get_collection(self, collection_uuid: UUID,
-                                      media_blocks_offset: int = 0,
+                             media_blocks_offset: int = 0,
                              media_blocks_limit: int | None = None) -> CollectionResponse:
+        blocks = self._blocks_lateral(Collection.uuid, media_blocks_offset, media_blocks_limit)
         stmt = (
-            select(Collection)
-            .options(
-                selectinload(Collection.blocks)
+            select(
+                Collection.uuid, Collection.name, Collection.startup_url, Collection.qr_code_url,
+                blocks.c.uuid.label("block_uuid"), blocks.c.photo_url, blocks.c.video_url,
+                blocks.c.photo_thumbnail_url, blocks.c.photo_webp_url,
+                blocks.c.features_url, blocks.c.tracking_score
             )
+            .outerjoin(blocks, true())
             .where(Collection.uuid == collection_uuid)
-            .offset(media_blocks_offset)
+            .order_by(blocks.c.created_at.desc(), blocks.c.uuid.desc())
         )
-        if media_blocks_limit:
-            stmt = stmt.limit(media_blocks_limit)
-
-        collection: Collection | None = await self.session.scalar(stmt)
-        if not collection:
+        rows = (await self.session.execute(stmt)).all()
+        if not rows:
             raise EntityNotFound(entity="collection", by_field="id")
 
-        return CollectionResponse.from_orm(collection)
+        return self._group_collection_rows(rows)[0]
 
     async def get_collections_by_user(self, telegram_user_id: int,
-                                      offset: int | None = None, limit: int | None = None) -> list[CollectionResponse]:
-        stmt = (
-            select(Collection)
-            .options(
-                selectinload(Collection.blocks)
+                                      offset: int | None = None, limit: int | None = None,
+                                      cursor: str | None = None,
+                                      blocks_per_collection: int | None = None) -> CollectionsPage:
+        page = (
+            select(
+                Collection.uuid, Collection.name, Collection.startup_url,
+                Collection.qr_code_url, Collection.created_at
             )
             .where(Collection.telegram_user_id == telegram_user_id)
-            .order_by(Collection.created_at.asc())
+            .order_by(Collection.created_at.asc(), Collection.uuid.asc())
         )
-        if offset:
-            stmt = stmt.offset(offset)
+        if cursor:
+            page = page.where(tuple_(Collection.created_at, Collection.uuid) > decode_cursor(cursor))
+        elif offset:
+            page = page.offset(offset)
         if limit:
-            stmt = stmt.limit(limit)
+            # Лишняя запись нужна только чтобы понять, есть ли следующая страница
+            page = page.limit(limit + 1)
+        page = page.subquery("page")
 
-        collections = await self.session.scalars(stmt)
-        return [CollectionResponse.from_orm(c) for c in collections]
-
-    async def get_collection_media_block(self, collection_uuid: UUID) -> list[MediaBlockSchema]:
+        blocks = self._blocks_lateral(page.c.uuid, limit=blocks_per_collection)
         stmt = (
-            select(MediaBlock)
-            .options(
-                load_only(MediaBlock.uuid, MediaBlock.photo_url, MediaBlock.video_url)
+            select(
+                page.c.uuid, page.c.name, page.c.startup_url, page.c.qr_code_url, page.c.created_at,
+                blocks.c.uuid.label("block_uuid"), blocks.c.photo_url, blocks.c.video_url,
+                blocks.c.photo_thumbnail_url, blocks.c.photo_webp_url,
+                blocks.c.features_url, blocks.c.tracking_score
+            )
+            .outerjoin(blocks, true())
+            .order_by(page.c.created_at.asc(), page.c.uuid.asc(),
+                      blocks.c.created_at.desc(), blocks.c.uuid.desc())
+        )
+        rows = (await self.session.execute(stmt)).all()
+        collections = self._group_collection_rows(rows)
+
+        next_cursor = None
+        if limit and len(collections) > limit:
+            collections = collections[:limit]
+            last = next(row for row in reversed(rows) if row.uuid == collections[-1].id)
+            next_cursor = encode_cursor(last.created_at, last.uuid)
+        return CollectionsPage.model_construct(items=collections, next_cursor=next_cursor)
+
+    async def get_collection_media_block(self, collection_uuid: UUID,
+                                         limit: int | None = None, cursor: str | None = None) -> MediaBlocksPage:
+        # Только нужные колонки строками: без ORM-объектов и identity map
+        stmt = (
+            select(
+                MediaBlock.uuid, MediaBlock.photo_url, MediaBlock.video_url,
+                MediaBlock.photo_thumbnail_url, MediaBlock.photo_webp_url,
+                MediaBlock.features_url, MediaBlock.tracking_score, MediaBlock.created_at
             )
             .where(MediaBlock.collection_uuid == collection_uuid)
-            .order_by(MediaBlock.created_at.desc())
+            .order_by(MediaBlock.created_at.desc(), MediaBlock.uuid.desc())
+        )
+        if cursor:
+            stmt = stmt.where(tuple_(MediaBlock.created_at, MediaBlock.uuid) < decode_cursor(cursor))
+        if limit:
+            stmt = stmt.limit(limit + 1)
+
+        rows = (await self.session.execute(stmt)).all()
+        next_cursor = None
+        if limit and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1].created_at, rows[-1].uuid)
+        construct_block = MediaBlockSchema.model_construct
+        return MediaBlocksPage.model_construct(
+            items=[
+                construct_block(
+                    id=row.uuid, photo_url=row.photo_url, video_url=row.video_url,
+                    photo_thumbnail_url=row.photo_thumbnail_url, photo_webp_url=row.photo_webp_url,
+                    features_url=row.features_url, tracking_score=row.tracking_score
+                )
+                for row in rows
+            ],
+            next_cursor=next_cursor
         )
-        blocks = await self.session.scalars(stmt)
-        return [MediaBlockSchema.from_orm(b) for b in blocks]
 
 
+    async def iter_media_urls(self, batch_size: int = 1000) -> AsyncIterator[str]:
+        # Все url файлов, на которые ссылается база, потоком с серверным курсором
+        stmt = union_all(
+            select(MediaBlock.photo_url),
+            select(MediaBlock.video_url),
+            select(MediaBlock.photo_thumbnail_url).where(MediaBlock.photo_thumbnail_url.is_not(None)),
+            select(MediaBlock.photo_webp_url).where(MediaBlock.photo_webp_url.is_not(None)),
+            select(MediaBlock.features_url).where(MediaBlock.features_url.is_not(None)),
+            select(Collection.qr_code_url).where(Collection.qr_code_url.is_not(None))
+        )
+        result = await self.session.stream_scalars(stmt, execution_options={"yield_per": batch_size})
+        async for url in result:
+            yield url
+
+    async def get_collection_changes(self, collection_uuid: UUID, since: int = 0) -> CollectionChanges:
+        # Версию коллекции читаем раньше блоков: изменение, закоммиченное между запросами,
+        # в худшем случае придет клиенту повторно, но не потеряется
+        collection = (await self.session.execute(
+            select(
+                Collection.uuid, Collection.name, Collection.startup_url,
+                Collection.qr_code_url, Collection.version
+            )
+            .where(Collection.uuid == collection_uuid)
+        )).one_or_none()
+        if not collection:
+            raise EntityNotFound(entity="collection", by_field="id")
+
+        # since из будущего (например, база восстановлена из бэкапа) - тоже полная выдача
+        full = since <= 0 or since > collection.version
+        blocks, deleted = [], []
+        if full or since < collection.version:
+            stmt = (
+                select(
+                    MediaBlock.uuid, MediaBlock.photo_url, MediaBlock.video_url,
+                    MediaBlock.photo_thumbnail_url, MediaBlock.photo_webp_url,
+                    MediaBlock.features_url, MediaBlock.tracking_score
+                )
+                .where(MediaBlock.collection_uuid == collection_uuid)
+                .order_by(MediaBlock.created_at.desc(), MediaBlock.uuid.desc())
+            )
+            if not full:
+                stmt = stmt.where(MediaBlock.updated_version > since)
+                deleted = list(await self.session.scalars(
+                    select(MediaBlockTombstone.block_uuid)
+                    .where(MediaBlockTombstone.collection_uuid == collection_uuid)
+                    .where(MediaBlockTombstone.deleted_version > since)
+                ))
+            construct_block = MediaBlockSchema.model_construct
+            blocks = [
+                construct_block(
+                    id=row.uuid, photo_url=row.photo_url, video_url=row.video_url,
+                    photo_thumbnail_url=row.photo_thumbnail_url, photo_webp_url=row.photo_webp_url,
+                    features_url=row.features_url, tracking_score=row.tracking_score
+                )
+                for row in await self.session.execute(stmt)
+            ]
+
+        return CollectionChanges.model_construct(
+            id=collection.uuid, name=collection.name,
+            startup_url=collection.startup_url, qr_code_url=collection.qr_code_url,
+            version=collection.version, full=full, blocks=blocks, deleted=deleted
+        )
+
+    async def get_collection_version(self, collection_uuid: UUID) -> int:
+        version: int | None = await self.session.scalar(
+            select(Collection.version).where(Collection.uuid == collection_uuid)
+        )
+        if version is None:
+            raise EntityNotFound(entity="collection", by_field="id")
+        return version
+
+    async def get_marker_hashes(self, collection_uuid: UUID | None = None,
+                                media_block_uuid: UUID | None = None) -> list[tuple[UUID, int]]:
+        # Перцептивные хеши фото коллекции. По media_block_uuid - коллекции этого блока, без него самого
+        stmt = select(MediaBlock.uuid, MediaBlock.photo_phash).where(MediaBlock.photo_phash.is_not(None))
+        if media_block_uuid:
+            block = aliased(MediaBlock)
+            stmt = stmt.where(
+                MediaBlock.collection_uuid == (
+                    select(block.collection_uuid).where(block.uuid == media_block_uuid).scalar_subquery()
+                ),
+                MediaBlock.uuid != media_block_uuid
+            )
+        else:
+            stmt = stmt.where(MediaBlock.collection_uuid == collection_uuid)
+        return [tuple(row) for row in await self.session.execute(stmt)]
+
     async def get_media_block(self, media_block_uuid: UUID) -> MediaBlockSchema:
         print(f'{media_block_uuid=}')
         stmt = (
@@ -134,19 +331,53 @@ class MediaCollectionRepository(MediaCollectionsRepositoryProtocol):
         print(f'{collection_uuid=}')
         return collection_uuid
 
+    async def _bump_version(self, collection_uuid: UUID) -> int:
+        # UPDATE блокирует строку коллекции до конца транзакции, поэтому параллельные изменения
+        # одной коллекции получают версии в порядке своих коммитов
+        stmt = (
+            update(Collection)
+            .values(version=Collection.version + 1)
+            .where(Collection.uuid == collection_uuid)
+            .returning(Collection.version)
+        )
+        version: int | None = await self.session.scalar(stmt)
+        if version is None:
+            raise EntityNotFound(entity="collection", by_field="id")
+        return version
+
     async def add_media_block_to_collection(self, collection_uuid: UUID, photo_url: str,
-                                            video_url: str, telegram_user_id: int) -> UUID:
+                                            video_url: str, telegram_user_id: int,
+                                            derivatives: dict[str, str | None] | None = None) -> UUID:
+        version = await self._bump_version(collection_uuid)
         stmt = (
             insert(MediaBlock)
             .values(
                 collection_uuid=collection_uuid,
-                photo_url=photo_url, video_url=video_url
+                photo_url=photo_url, video_url=video_url,
+                updated_version=version,
+                **(derivatives or {})
             )
             .returning(MediaBlock.uuid)
         )
         block_uuid: UUID = await self.session.scalar(stmt)
         return block_uuid
 
+    async def add_media_blocks_to_collection(self, collection_uuid: UUID, blocks: list[dict[str, str | None]],
+                                             telegram_user_id: int) -> list[UUID]:
+        # Один INSERT на все блоки (block - значения колонок: photo_url, video_url и производные).
+        # uuid генерируем сами, чтобы порядок ответа не зависел от порядка строк в RETURNING
+        block_uuids = [uuid4() for _ in blocks]
+        version = await self._bump_version(collection_uuid)
+        stmt = (
+            insert(MediaBlock)
+            .values([
+                dict(block, uuid=block_uuid, collection_uuid=collection_uuid, updated_version=version)
+                for block_uuid, block in zip(block_uuids, blocks)
+            ])
+            .returning(MediaBlock.uuid)
+        )
+        inserted = set(await self.session.scalars(stmt))
+        return [block_uuid for block_uuid in block_uuids if block_uuid in inserted]
 
     async def delete_collection(self, collection_uuid: UUID, telegram_user_id: int) -> None:
         stmt = (
@@ -159,38 +390,50 @@ class MediaCollectionRepository(MediaCollectionsRepositoryProtocol):
         if not uuid:
             raise EntityNotFound(entity="collection", by_field="id")
 
-    async def delete_media_block(self, media_block_uuid: UUID, telegram_user_id: int) -> None:
+    async def delete_media_block(self, media_block_uuid: UUID, telegram_user_id: int) -> UUID:
         stmt = (
             delete(MediaBlock)
             .where(MediaBlock.uuid == media_block_uuid)
+            .where(MediaBlock.collection_uuid == Collection.uuid)
             .where(Collection.telegram_user_id == telegram_user_id)
-            .returning(MediaBlock.uuid)
+            .returning(MediaBlock.collection_uuid)
         )
-        uuid: UUID | None = await self.session.scalar(stmt)
-        if not uuid:
+        collection_uuid: UUID | None = await self.session.scalar(stmt)
+        if not collection_uuid:
             raise EntityNotFound(entity="media_block", by_field="id")
 
+        version = await self._bump_version(collection_uuid)
+        await self.session.execute(
+            insert(MediaBlockTombstone)
+            .values(block_uuid=media_block_uuid, collection_uuid=collection_uuid, deleted_version=version)
+        )
+        return collection_uuid
+
     async def update_media_block(self, media_block_uuid: UUID, telegram_user_id: int,
-                                 updates: dict) -> None:
+                                 updates: dict) -> UUID:
         stmt = (
             update(MediaBlock)
             .values(**updates)
-
-            # TODO: Исправить
             .where(MediaBlock.uuid == media_block_uuid)
-
+            .where(MediaBlock.collection_uuid == Collection.uuid)
             .where(Collection.telegram_user_id == telegram_user_id)
-            .returning(MediaBlock.uuid)
+            .returning(MediaBlock.collection_uuid)
         )
-        uuid: UUID | None = await self.session.scalar(stmt)
-        if not uuid:
+        collection_uuid: UUID | None = await self.session.scalar(stmt)
+        if not collection_uuid:
             raise EntityNotFound(entity="media_block", by_field="id")
 
+        version = await self._bump_version(collection_uuid)
+        await self.session.execute(
+            update(MediaBlock).values(updated_version=version).where(MediaBlock.uuid == media_block_uuid)
+        )
+        return collection_uuid
+
     async def update_collection_name(self, collection_uuid: UUID, telegram_user_id: int,
                                      name: str) -> None:
         stmt = (
             update(Collection)
-            .values(name=name)
+            .values(name=name, version=Collection.version + 1)
             .where(Collection.uuid == collection_uuid)
             .where(Collection.telegram_user_id == telegram_user_id)
             .returning(Collection.uuid)
@@ -203,7 +446,7 @@ class MediaCollectionRepository(MediaCollectionsRepositoryProtocol):
                                 updates: dict) -> None:
         stmt = (
             update(Collection)
-            .values(**updates)
+            .values(**updates, version=Collection.version + 1)
             .where(Collection.uuid == collection_uuid)
             .where(Collection.telegram_user_id == telegram_user_id)
             .returning(Collection.uuid)
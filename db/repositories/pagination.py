@@ -0,0 +1,20 @@
+import base64
+from datetime import datetime
+from uuid import UUID
+
+from exceptions.core import InvalidCursor
+
+
+# Курсор - непрозрачная для клиента строка с ключом (created_at, uuid) последней записи страницы
+def encode_cursor(created_at: datetime, uuid: UUID) -> str:
+    raw = f'{created_at.isoformat()}|{uuid}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, UUID]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, uuid = raw.split("|")
+        return datetime.fromisoformat(created_at), UUID(uuid)
+    except ValueError:
+        raise InvalidCursor
@@ -3,6 +3,8 @@ from typing import AsyncGenerator, Type
 import abc
 from db.repositories import UsersRepositoryProtocol, UsersRepository
 from db.repositories import MediaCollectionsRepositoryProtocol, MediaCollectionRepository
+from db.main import mark_primary_required, read_session, read_sessionmaker
+from monitoring.profiler import span
 from typing_extensions import Protocol, Self, AsyncContextManager
 
 
@@ -18,6 +20,13 @@ class UnitOfWorkProtocol(abc.ABC):
     async def __aexit__(self, exc_type, exc_val, exc_tb) -> bool:
         ...
 
+    def pinned(self) -> Self:
+        return self
+
+    @property
+    def source(self) -> object:
+        return None
+
 
 
 class UnitOfWork(UnitOfWorkProtocol):
@@ -27,23 +36,43 @@ class UnitOfWork(UnitOfWorkProtocol):
     def __init__(self,
                  session_factory,
                  users_repository: Type[UsersRepositoryProtocol],
-                 media_collections_repository: Type[MediaCollectionsRepositoryProtocol]):
+                 media_collections_repository: Type[MediaCollectionsRepositoryProtocol],
+                 read_only: bool = False):
         self.session_factory = session_factory
         self._session = None
         self.users_repository = users_repository
         self.media_collections_repository = media_collections_repository
+        self.read_only = read_only
+
+    def pinned(self) -> Self:
+        # Копия с источником сессий, выбранным сейчас, в контексте вызывающего. Нужна, когда чтение
+        # выполняется в другой задаче: ее выбор реплики в запрос не вернется, а primary_required запроса она не увидит
+        session_factory = read_sessionmaker() if self.session_factory is read_session else self.session_factory
+        return UnitOfWork(
+            session_factory, self.users_repository, self.media_collections_repository, read_only=self.read_only
+        )
+
+    @property
+    def source(self) -> object:
+        # База, в которую пойдут запросы (фабрика сессий), - часть ключа общих загрузок
+        return self.session_factory
 
     async def __aenter__(self) -> Self:
         uow = await super(UnitOfWork, self).__aenter__()
         self._session = self.session_factory()
+        if self.read_only:
+            # Транзакция READ ONLY: база сама не даст случайно записать, а коммит не нужен
+            await self._session.connection(execution_options={"postgresql_readonly": True})
         return uow
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        if exc_type:
-            await self._session.rollback()
-        else:
-            await self._session.commit()
-        await self._session.close()
+        with span("db"):
+            if exc_type or self.read_only:
+                await self._session.rollback()
+            else:
+                await self._session.commit()
+                mark_primary_required()
+            await self._session.close()
 
     @property
     def users(self) -> UsersRepositoryProtocol:
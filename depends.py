@@ -3,17 +3,23 @@ from fastapi import Depends, Security
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from pydantic import BaseModel
 
+from config import settings
+
 from services import FileStorageServiceProtocol, FileStorageService
-from services import AuthServiceProtocol, AuthService
-from services import TelegramUtilsService, TelegramUtilsServiceProtocol
-from services import QrCodeService, QrCodeServiceProtocol
+from services import AuthServiceProtocol, AuthService, create_token_cache
+from services import TelegramUtilsService, TelegramUtilsServiceProtocol, create_init_data_cache
+from services import QrCodeService, QrCodeServiceProtocol, create_qr_code_cache
+from services import PhotoPipelineService, PhotoPipelineServiceProtocol
+from services.collection_cache import create_collection_cache
+from services.single_flight import SingleFlight
+from services.upload_sessions import UploadSessionService, UploadSessionServiceProtocol
 
 from use_cases import MediaUseCase, MediaUseCaseProtocol
 from use_cases import AuthUseCase, AuthUseCaseProtocol
 from db.repositories import MediaCollectionRepository
 from db.repositories import UsersRepository
 from db.unit_of_work import UnitOfWork, UnitOfWorkProtocol
-from db.main import async_session
+from db.main import async_session, read_session
 
 
 # -- unit of work --
@@ -26,10 +32,22 @@ def get_unit_of_work() -> UnitOfWorkProtocol:
 
 UnitOfWorkAnnotated = Annotated[UnitOfWorkProtocol, Depends(get_unit_of_work)]
 
+def get_read_unit_of_work() -> UnitOfWorkProtocol:
+    return UnitOfWork(
+        session_factory=read_session,
+        users_repository=UsersRepository,
+        media_collections_repository=MediaCollectionRepository,
+        read_only=True
+    )
+
+ReadUnitOfWorkAnnotated = Annotated[UnitOfWorkProtocol, Depends(get_read_unit_of_work)]
+
 
 # -- services --
+qr_code_cache = create_qr_code_cache()
+
 def get_qr_code_service() -> QrCodeServiceProtocol:
-    return QrCodeService()
+    return QrCodeService(cache=qr_code_cache)
 
 QrCodeServiceAnnotated = Annotated[QrCodeServiceProtocol, Depends(get_qr_code_service)]
 
@@ -43,22 +61,46 @@ def get_telegram_utils_service() -> TelegramUtilsServiceProtocol:
 
 TelegramUtilsServiceAnnotated = Annotated[TelegramUtilsServiceProtocol, Depends(get_telegram_utils_service)]
 
+def get_photo_pipeline_service(
+        file_storage_service: FileStorageServiceAnnotated
+) -> PhotoPipelineServiceProtocol | None:
+    if not settings.photo_pipeline.enabled:
+        return None
+    return PhotoPipelineService(file_storage_service)
+
+PhotoPipelineServiceAnnotated = Annotated[PhotoPipelineServiceProtocol | None, Depends(get_photo_pipeline_service)]
+
+def get_upload_session_service() -> UploadSessionServiceProtocol:
+    return UploadSessionService()
+
+UploadSessionServiceAnnotated = Annotated[UploadSessionServiceProtocol, Depends(get_upload_session_service)]
+
+token_cache = create_token_cache()
+
 def get_auth_service() -> AuthServiceProtocol:
-    return AuthService()
+    return AuthService(token_cache=token_cache)
 
 AuthServiceAnnotated = Annotated[AuthServiceProtocol, Depends(get_auth_service)]
 
 
 
 # -- use_cases --
+init_data_cache = create_init_data_cache()
+collection_cache = create_collection_cache()
+collection_single_flight = SingleFlight()
+
 def get_media_use_case(
         file_storage_service: FileStorageServiceAnnotated,
         uof: UnitOfWorkAnnotated,
         qr_code_service: QrCodeServiceAnnotated,
-        telegram_utils_service: TelegramUtilsServiceAnnotated
+        telegram_utils_service: TelegramUtilsServiceAnnotated,
+        read_uow: ReadUnitOfWorkAnnotated,
+        photo_pipeline: PhotoPipelineServiceAnnotated,
+        upload_sessions: UploadSessionServiceAnnotated
 ) -> MediaUseCaseProtocol:
     return MediaUseCase(
-        file_storage_service, uof, telegram_utils_service, qr_code_service
+        file_storage_service, uof, telegram_utils_service, qr_code_service, collection_cache, read_uow,
+        photo_pipeline, collection_single_flight, upload_sessions
     )
 
 MediaUseCaseAnnotated = Annotated[MediaUseCaseProtocol, Depends(get_media_use_case)]
@@ -69,7 +111,7 @@ def get_auth_use_case(
     uof: UnitOfWorkAnnotated
 ) -> AuthUseCaseProtocol:
     return AuthUseCase(
-        auth_service, uof, telegram_utils_service
+        auth_service, uof, telegram_utils_service, init_data_cache
     )
 
 AuthUseCaseAnnotated = Annotated[AuthUseCaseProtocol, Depends(get_auth_use_case)]
@@ -84,9 +126,7 @@ async def get_current_user(
     auth_service: AuthServiceAnnotated,
     token: HTTPAuthorizationCredentials = Security(HTTPBearer())
 ) -> CurrentUser:
-    print(f'{token.credentials=}')
     token_data = await auth_service.validate_token(access_token=token.credentials)
-    print(f'{token_data=}')
     # return CurrentUser(
     #     id=0, telegram_id=0
     # )
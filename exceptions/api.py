@@ -1,5 +1,7 @@
 from fastapi import Request, HTTPException, FastAPI
-from exceptions.core import EntityNotFound, ExpiredToken, InvalidToken, InvalidInitDataException
+from exceptions.core import EntityNotFound, ExpiredToken, InvalidToken, InvalidInitDataException, FileTooLarge, \
+    InvalidFileFormat, RangeNotSatisfiable, InvalidCursor, UnsuitableArTarget, \
+    DuplicateMarker, UploadOffsetMismatch, UploadIncomplete, ImageTooLarge
 from starlette.responses import JSONResponse
 
 
@@ -32,10 +34,85 @@ def invalid_init_data_error(request: Request, exc: InvalidInitDataException):
         detail=exc.message
     )
 
+async def file_too_large_error(request: Request, exc: FileTooLarge):
+    return JSONResponse(
+        status_code=413,
+        content={"detail": {"message": exc.message, "maxSize": exc.max_size}}
+    )
+
+
+async def invalid_file_format_error(request: Request, exc: InvalidFileFormat):
+    return JSONResponse(
+        status_code=415,
+        content={"detail": exc.message}
+    )
+
+async def range_not_satisfiable_error(request: Request, exc: RangeNotSatisfiable):
+    return JSONResponse(
+        status_code=416,
+        content={"detail": exc.message},
+        headers={"Content-Range": f"bytes */{exc.size}"}
+    )
+
+async def invalid_cursor_error(request: Request, exc: InvalidCursor):
+    return JSONResponse(
+        status_code=400,
+        content={"detail": exc.message}
+    )
+
+async def image_too_large_error(request: Request, exc: ImageTooLarge):
+    return JSONResponse(
+        status_code=413,
+        content={"detail": {"message": exc.message, "maxPixels": exc.max_pixels}}
+    )
+
+async def unsuitable_ar_target_error(request: Request, exc: UnsuitableArTarget):
+    return JSONResponse(
+        status_code=422,
+        content={"detail": {
+            "message": exc.message,
+            "trackingScore": round(exc.tracking_score, 3),
+            "minScore": exc.min_score
+        }}
+    )
+
+async def duplicate_marker_error(request: Request, exc: DuplicateMarker):
+    return JSONResponse(
+        status_code=409,
+        content={"detail": {
+            "message": exc.message,
+            "similarBlockId": str(exc.similar_block_id) if exc.similar_block_id else None,
+            "distance": exc.distance
+        }}
+    )
+
+
+async def upload_offset_mismatch_error(request: Request, exc: UploadOffsetMismatch):
+    return JSONResponse(
+        status_code=409,
+        content={"detail": {"message": exc.message, "offset": exc.offset}},
+        headers={"Upload-Offset": str(exc.offset), "Tus-Resumable": "1.0.0"}
+    )
+
+async def upload_incomplete_error(request: Request, exc: UploadIncomplete):
+    return JSONResponse(
+        status_code=409,
+        content={"detail": {"message": exc.message, "offset": exc.offset, "length": exc.length}}
+    )
+
 
 def register_errors(app: FastAPI):
     app.exception_handler(EntityNotFound)(entity_not_found_error)
     app.exception_handler(ExpiredToken)(expired_token_error)
     app.exception_handler(InvalidToken)(invalid_token_error)
     app.exception_handler(InvalidInitDataException)(invalid_init_data_error)
+    app.exception_handler(FileTooLarge)(file_too_large_error)
+    app.exception_handler(InvalidFileFormat)(invalid_file_format_error)
+    app.exception_handler(RangeNotSatisfiable)(range_not_satisfiable_error)
+    app.exception_handler(InvalidCursor)(invalid_cursor_error)
+    app.exception_handler(ImageTooLarge)(image_too_large_error)
+    app.exception_handler(UnsuitableArTarget)(unsuitable_ar_target_error)
+    app.exception_handler(DuplicateMarker)(duplicate_marker_error)
+    app.exception_handler(UploadOffsetMismatch)(upload_offset_mismatch_error)
+    app.exception_handler(UploadIncomplete)(upload_incomplete_error)
     return app
\ No newline at end of file
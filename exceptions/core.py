@@ -23,4 +23,72 @@ class EntityNotFound(Exception):
     def __init__(self, entity: str, by_field: str, *args):
         self.by_field = by_field
         self.entity = entity
-        super(EntityNotFound, self).__init__(*args)
\ No newline at end of file
+        super(EntityNotFound, self).__init__(*args)
+
+
+class FileTooLarge(Exception):
+    message = "Файл слишком большой"
+
+    def __init__(self, max_size: int, *args):
+        self.max_size = max_size
+        super(FileTooLarge, self).__init__(*args)
+
+
+class InvalidFileFormat(Exception):
+    message = "Неподдерживаемый формат файла"
+
+
+class RangeNotSatisfiable(Exception):
+    message = "Запрошенный диапазон недоступен"
+
+    def __init__(self, size: int, *args):
+        self.size = size
+        super(RangeNotSatisfiable, self).__init__(*args)
+
+
+class InvalidCursor(Exception):
+    message = "Невалидный курсор пагинации"
+
+
+class ImageTooLarge(Exception):
+    message = "Слишком большое разрешение изображения"
+
+    def __init__(self, max_pixels: int, *args):
+        self.max_pixels = max_pixels
+        # max_pixels в args: исключение передается из пула процессов через pickle
+        super(ImageTooLarge, self).__init__(max_pixels, *args)
+
+
+class UnsuitableArTarget(Exception):
+    message = "Фото не подходит для AR-трекинга: мало деталей или низкий контраст"
+
+    def __init__(self, tracking_score: float, min_score: float, *args):
+        self.tracking_score = tracking_score
+        self.min_score = min_score
+        super(UnsuitableArTarget, self).__init__(*args)
+
+
+class DuplicateMarker(Exception):
+    message = "В коллекции уже есть блок с похожим фото, AR-трекер будет их путать"
+
+    def __init__(self, similar_block_id, distance: int, *args):
+        self.similar_block_id = similar_block_id
+        self.distance = distance
+        super(DuplicateMarker, self).__init__(*args)
+
+
+class UploadOffsetMismatch(Exception):
+    message = "Upload-Offset не совпадает с уже полученными данными"
+
+    def __init__(self, offset: int, *args):
+        self.offset = offset
+        super(UploadOffsetMismatch, self).__init__(*args)
+
+
+class UploadIncomplete(Exception):
+    message = "Загрузка еще не завершена"
+
+    def __init__(self, offset: int, length: int, *args):
+        self.offset = offset
+        self.length = length
+        super(UploadIncomplete, self).__init__(*args)
@@ -0,0 +1,129 @@
+import json
+import logging
+import random
+import time
+
+from config import settings
+from monitoring.metrics import REGISTRY, Counter, Gauge, Histogram
+from monitoring.profiler import RequestProfile, current_profile
+from starlette.datastructures import MutableHeaders
+from starlette.routing import Match
+from starlette.types import ASGIApp, Scope, Receive, Send, Message
+
+REQUESTS = REGISTRY.register(Counter(
+    "http_requests_total", "Количество HTTP-запросов", ("method", "route", "status")
+))
+LATENCY = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "Время обработки HTTP-запроса", ("method", "route")
+))
+IN_PROGRESS = REGISTRY.register(Gauge(
+    "http_requests_in_progress", "HTTP-запросы в обработке", ("method", "route")
+))
+REQUEST_BYTES = REGISTRY.register(Counter(
+    "http_request_size_bytes_total", "Получено байт в телах запросов", ("method", "route")
+))
+RESPONSE_BYTES = REGISTRY.register(Counter(
+    "http_response_size_bytes_total", "Отправлено байт в телах ответов", ("method", "route")
+))
+
+UNMATCHED_ROUTE = "unmatched"
+
+slow_requests_logger = logging.getLogger("slow_requests")
+
+
+class PrometheusMiddleware:
+    # Чистый ASGI-middleware (без BaseHTTPMiddleware): не создает задач и не буферизует тело.
+    # Метка route - шаблон пути (/collections/{collection_id}), а не сам путь, чтобы число рядов было ограничено
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    @staticmethod
+    def __get_route(scope: Scope) -> str:
+        router = scope["app"].router
+        for route in router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+        return UNMATCHED_ROUTE
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        labels = (scope["method"], self.__get_route(scope))
+        status = 500
+        request_bytes = 0
+        response_bytes = 0
+
+        async def receive_wrapper() -> Message:
+            nonlocal request_bytes
+            message = await receive()
+            if message["type"] == "http.request":
+                request_bytes += len(message.get("body", b""))
+            return message
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status, response_bytes
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                response_bytes += len(message.get("body", b""))
+            else:
+                response_bytes += message.get("count", 0)
+            await send(message)
+
+        IN_PROGRESS.inc(labels)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            LATENCY.observe(labels, time.perf_counter() - started)
+            IN_PROGRESS.dec(labels)
+            REQUESTS.inc(labels + (status,))
+            REQUEST_BYTES.inc(labels, request_bytes)
+            RESPONSE_BYTES.inc(labels, response_bytes)
+
+
+class ProfilerMiddleware:
+    # Включается настройкой PROFILING=1: собирает запросы к БД и время участков кода
+    # текущего запроса, отдает их в Server-Timing и пишет выборку медленных запросов в лог
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(method=scope["method"], path=scope["path"])
+        token = current_profile.set(profile)
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                profile.response_started_at = time.perf_counter()
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", profile.server_timing())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_profile.reset(token)
+            self.__log_if_slow(profile)
+
+    @staticmethod
+    def __log_if_slow(profile: RequestProfile) -> None:
+        duration = time.perf_counter() - profile.started_at
+        if duration * 1000 < settings.profiling.slow_request_ms or random.random() >= settings.profiling.sample_rate:
+            return
+        slow_requests_logger.warning(json.dumps(dict(
+            method=profile.method,
+            path=profile.path,
+            duration_ms=round(duration * 1000, 2),
+            db_ms=round(profile.db_time * 1000, 2),
+            query_count=profile.query_count,
+            spans_ms={name: round(value * 1000, 2) for name, value in profile.spans.items()},
+            repeated_statements=profile.repeated_statements(),
+            statements=[dict(sql=statement, ms=round(d * 1000, 2)) for statement, d in profile.statements],
+        ), ensure_ascii=False))
@@ -0,0 +1,62 @@
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from config import settings
+
+
+class RequestProfile:
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.started_at = time.perf_counter()
+        self.endpoint_finished_at: float | None = None
+        self.response_started_at: float | None = None
+        self.db_time = 0.0
+        self.query_count = 0
+        self.statements: list[tuple[str, float]] = []
+        self.statement_counts: Counter[str] = Counter()
+        self.spans: dict[str, float] = {}
+
+    def add_query(self, statement: str, duration: float) -> None:
+        self.db_time += duration
+        self.query_count += 1
+        self.statement_counts[statement] += 1
+        if len(self.statements) < settings.profiling.max_statements:
+            self.statements.append((statement, duration))
+
+    def add_span(self, name: str, duration: float) -> None:
+        self.spans[name] = self.spans.get(name, 0.0) + duration
+
+    def repeated_statements(self, threshold: int = settings.profiling.n_plus_one_threshold) -> dict[str, int]:
+        # Один и тот же текст запроса много раз за запрос - признак N+1
+        return {statement: count for statement, count in self.statement_counts.items() if count >= threshold}
+
+    def server_timing(self) -> str:
+        finished_at = self.response_started_at or time.perf_counter()
+        timings = [f'db;dur={(self.db_time + self.spans.get("db", 0.0)) * 1000:.2f};desc="{self.query_count} queries"']
+        for name in ("storage", "qr", "photo"):
+            if name in self.spans:
+                timings.append(f'{name};dur={self.spans[name] * 1000:.2f}')
+        if self.endpoint_finished_at is not None:
+            timings.append(f'serialization;dur={(finished_at - self.endpoint_finished_at) * 1000:.2f}')
+        timings.append(f'total;dur={(finished_at - self.started_at) * 1000:.2f}')
+        return ", ".join(timings)
+
+
+current_profile: ContextVar[RequestProfile | None] = ContextVar("current_profile", default=None)
+
+
+@contextmanager
+def span(name: str):
+    # Время участка кода попадает в Server-Timing текущего запроса; без профилировщика - ничего не делает
+    profile = current_profile.get()
+    if profile is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_span(name, time.perf_counter() - started)
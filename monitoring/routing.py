@@ -0,0 +1,28 @@
+import functools
+import time
+from typing import Callable
+
+from config import settings
+from fastapi.routing import APIRoute
+from monitoring.profiler import current_profile
+
+
+def mark_endpoint_finished(endpoint: Callable) -> Callable:
+    # Все, что после возврата из эндпоинта и до начала ответа, - валидация и сериализация ответа
+    @functools.wraps(endpoint)
+    async def wrapper(*args, **kwargs):
+        try:
+            return await endpoint(*args, **kwargs)
+        finally:
+            profile = current_profile.get()
+            if profile is not None:
+                profile.endpoint_finished_at = time.perf_counter()
+
+    return wrapper
+
+
+class ProfiledRoute(APIRoute):
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        if settings.profiling.enabled:
+            endpoint = mark_endpoint_finished(endpoint)
+        super().__init__(path, endpoint, **kwargs)
@@ -0,0 +1,25 @@
+import time
+
+from monitoring.profiler import current_profile
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_profile.get() is not None:
+        conn.info.setdefault("profiler_started_at", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = current_profile.get()
+    if profile is None:
+        return
+    started = conn.info.get("profiler_started_at")
+    if started:
+        # Запросы строятся с bind-параметрами, поэтому текст запроса и есть его "форма"
+        profile.add_query(statement, time.perf_counter() - started.pop())
+
+
+def install_sql_profiler(engine: AsyncEngine) -> None:
+    event.listen(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine.sync_engine, "after_cursor_execute", after_cursor_execute)
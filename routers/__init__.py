@@ -2,5 +2,10 @@ from .config import Routes
 from .media import router as media_router
 from .auth import router as auth_router
 from .docs import router as docs_router
+from .cdn import router as cdn_router
+from .metrics import router as metrics_router
+from .uploads import router as uploads_router
+from config import settings
 
-__routes__ = Routes(routers=(docs_router, media_router, auth_router))
\ No newline at end of file
+__routes__ = Routes(routers=(docs_router, media_router, uploads_router, auth_router, metrics_router)
+                           + ((cdn_router,) if settings.serve_media else ()))
\ No newline at end of file
@@ -1,10 +1,11 @@
 from typing import Annotated
 
 from fastapi import APIRouter, Body
+from monitoring.routing import ProfiledRoute
 from schemas.auth import TokensResponse
 from depends import AuthUseCaseAnnotated
 
-router = APIRouter(prefix="/auth", tags=["Авторизация"])
+router = APIRouter(prefix="/auth", tags=["Авторизация"], route_class=ProfiledRoute)
 
 
 @router.post("/create_tokens")
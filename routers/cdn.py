@@ -0,0 +1,74 @@
+import os
+import re
+from email.utils import formatdate
+
+import aiofiles
+import aiofiles.os
+from exceptions.core import EntityNotFound
+from fastapi import APIRouter, Request
+from routers.responses import MediaFileResponse, not_modified
+from services.file_storage import FileStorageService, detect_format, SIGNATURE_LENGTH
+from starlette.responses import Response
+
+router = APIRouter(prefix=f"/{FileStorageService.media_url}", tags=["Медиафайлы"])
+
+MEDIA_TYPES = {
+    "jpg": "image/jpeg",
+    "png": "image/png",
+    "svg": "image/svg+xml",
+    "webp": "image/webp",
+    "heic": "image/heic",
+    "mp4": "video/mp4",
+    "mov": "video/quicktime",
+    "webm": "video/webm",
+    "arft": "application/octet-stream",
+}
+
+# Имя файла в режиме content-addressed: sha256 содержимого (+ формат)
+CONTENT_ADDRESSED_NAME = re.compile(r"^([0-9a-f]{64})(\.\w+)?$")
+
+
+async def _get_media_type(path: str, filename: str) -> str:
+    _, _, extension = filename.rpartition(".")
+    if extension in MEDIA_TYPES:
+        return MEDIA_TYPES[extension]
+    # Старые файлы сохранялись без расширения - определяем формат по сигнатуре
+    async with aiofiles.open(path, "rb") as f:
+        head = await f.read(SIGNATURE_LENGTH)
+    return MEDIA_TYPES.get(detect_format(head), "application/octet-stream")
+
+
+@router.api_route("/{filename}", methods=["GET", "HEAD"])
+async def get_media_file(
+    filename: str,
+    request: Request
+) -> Response:
+    if os.path.basename(filename) != filename or filename.startswith("."):
+        raise EntityNotFound(entity="file", by_field="filename")
+
+    path = os.path.join(FileStorageService.dir_path, filename)
+    try:
+        stat_result = await aiofiles.os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        raise EntityNotFound(entity="file", by_field="filename")
+
+    content_addressed = CONTENT_ADDRESSED_NAME.match(filename)
+    if content_addressed:
+        # Содержимое файла никогда не меняется - хеш и есть ETag
+        etag = f'"{content_addressed.group(1)}"'
+        cache_control = "public, max-age=31536000, immutable"
+    else:
+        etag = f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+        cache_control = "public, max-age=86400"
+
+    headers = {"cache-control": cache_control}
+    if not_modified(request.headers, etag, stat_result.st_mtime):
+        headers["etag"] = etag
+        headers["last-modified"] = formatdate(stat_result.st_mtime, usegmt=True)
+        return Response(status_code=304, headers=headers)
+
+    return MediaFileResponse(
+        path=path, stat_result=stat_result, request_headers=request.headers, etag=etag,
+        media_type=await _get_media_type(path, filename), headers=headers,
+        send_body=request.method != "HEAD"
+    )
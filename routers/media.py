@@ -1,13 +1,26 @@
 from typing import Annotated
 
 from depends import MediaUseCaseAnnotated, CurrentUserAnnotated
-from fastapi import APIRouter, UploadFile, Body, Query
+from config import settings
+from fastapi import APIRouter, UploadFile, Body, Query, HTTPException, Request
+from monitoring.routing import ProfiledRoute
+from routers.responses import ModelResponse, BundleResponse, not_modified
 from schemas.api import BaseResponse
 from schemas.media_collections import CollectionResponse, CreatedCollectionResponse, CreatedMediaBlockResponse, \
-    MediaBlock
+    MediaBlock, CollectionsPage, MediaBlocksPage, CollectionChanges, MediaBlockUploads
+from services.file_storage import read_chunks
+from starlette.responses import Response
 from uuid import UUID
 
-router = APIRouter(prefix="/collections", tags=["Коллекции"])
+router = APIRouter(prefix="/collections", tags=["Коллекции"], route_class=ProfiledRoute)
+
+# Увеличить при изменении формата ответов коллекции, чтобы старые ETag перестали совпадать
+REPRESENTATION_VERSION = 1
+
+
+def _collection_cache_headers(version: int) -> dict[str, str]:
+    # ETag - версия коллекции: ее проверка - один поиск по первичному ключу, без чтения блоков
+    return {"etag": f'"{REPRESENTATION_VERSION}.{version}"', "cache-control": settings.cache.http_cache_control}
 
 
 @router.post("")
@@ -32,38 +45,111 @@ async def send_media(
     media_block = await media_use_case.add_media_block_to_collection(
         collection_uuid=collection_id,
         telegram_user_id=current_user.telegram_id,
-        photo=await photo.read(),
-        video=await video.read()
+        photo=read_chunks(photo),
+        video=read_chunks(video)
     )
     return media_block
 
 
-@router.get("/my")
+@router.post("/{collection_id}/media_blocks/from_uploads")
+async def send_media_from_uploads(
+    collection_id: UUID,
+    uploads: MediaBlockUploads,
+    current_user: CurrentUserAnnotated,
+    media_use_case: MediaUseCaseAnnotated
+) -> CreatedMediaBlockResponse:
+    # Фото и видео, загруженные по частям через /uploads
+    return await media_use_case.add_media_block_from_uploads(
+        collection_uuid=collection_id,
+        telegram_user_id=current_user.telegram_id,
+        photo_upload_id=uploads.photo_upload_id,
+        video_upload_id=uploads.video_upload_id
+    )
+
+
+@router.post("/{collection_id}/media_blocks/batch")
+async def send_media_batch(
+    collection_id: UUID,
+    photos: list[UploadFile],
+    videos: list[UploadFile],
+    current_user: CurrentUserAnnotated,
+    media_use_case: MediaUseCaseAnnotated
+) -> list[CreatedMediaBlockResponse]:
+    if len(photos) != len(videos):
+        raise HTTPException(status_code=422, detail="Количество фото и видео должно совпадать")
+    if len(photos) > settings.storage.max_batch_blocks:
+        raise HTTPException(
+            status_code=422, detail=f"Не больше {settings.storage.max_batch_blocks} блоков за запрос"
+        )
+    return await media_use_case.add_media_blocks_to_collection(
+        collection_uuid=collection_id,
+        telegram_user_id=current_user.telegram_id,
+        blocks=[(read_chunks(photo), read_chunks(video)) for photo, video in zip(photos, videos)]
+    )
+
+
+@router.get("/my", response_model=CollectionsPage)
 async def get_my_collections(
     current_user: CurrentUserAnnotated,
     media_use_case: MediaUseCaseAnnotated,
     offset: int = Query(default=0, ge=0),
-    limit: int = Query(default=None, ge=1)
-) -> list[CollectionResponse]:
-    return await media_use_case.get_user_collections(
+    limit: int = Query(default=None, ge=1),
+    cursor: str | None = Query(default=None),
+    blocks_per_collection: int | None = Query(default=None, ge=0)
+) -> ModelResponse:
+    return ModelResponse(await media_use_case.get_user_collections(
         telegram_user_id=current_user.telegram_id,
-        offset=offset, limit=limit
-    )
+        offset=offset, limit=limit, cursor=cursor,
+        blocks_per_collection=blocks_per_collection
+    ))
 
 
-@router.get("/{collection_id}")
+@router.get("/{collection_id}", response_model=CollectionResponse)
 async def get_collection(
     collection_id: UUID,
+    request: Request,
     media_use_case: MediaUseCaseAnnotated,
     offset: int = Query(default=0, ge=0),
     limit: int | None = Query(default=None, ge=1)
-) -> CollectionResponse:
+) -> Response:
+    version = await media_use_case.get_collection_version(collection_uuid=collection_id)
+    headers = _collection_cache_headers(version)
+    if not_modified(request.headers, headers["etag"]):
+        return Response(status_code=304, headers=headers)
     collection = await media_use_case.get_collection(
         collection_uuid=collection_id,
         media_blocks_offset=offset,
-        media_blocks_limit=limit
+        media_blocks_limit=limit,
+        version=version
     )
-    return collection
+    return ModelResponse(collection, headers=headers)
+
+
+@router.get("/{collection_id}/bundle", response_class=BundleResponse, status_code=200)
+async def get_collection_bundle(
+    collection_id: UUID,
+    request: Request,
+    media_use_case: MediaUseCaseAnnotated
+) -> Response:
+    # Манифест и все медиафайлы коллекции одним tar-архивом для предзагрузки перед AR-сессией
+    bundle = await media_use_case.get_collection_bundle(collection_uuid=collection_id)
+    etag = f'"{bundle.etag}"'
+    headers = {"content-disposition": f'attachment; filename="{collection_id}.tar"'}
+    if not_modified(request.headers, etag):
+        return Response(status_code=304, headers={"etag": etag})
+    return BundleResponse(bundle, request_headers=request.headers, etag=etag, headers=headers)
+
+
+@router.get("/{collection_id}/sync", response_model=CollectionChanges)
+async def sync_collection(
+    collection_id: UUID,
+    media_use_case: MediaUseCaseAnnotated,
+    since: int = Query(default=0, ge=0)
+) -> ModelResponse:
+    # since - version из предыдущего ответа; 0 - получить коллекцию целиком
+    return ModelResponse(await media_use_case.get_collection_changes(
+        collection_uuid=collection_id, since=since
+    ))
 
 
 @router.delete("/{collection_id}")
@@ -117,18 +203,10 @@ async def patch_block(
     video: UploadFile | None = None,
     photo: UploadFile | None = None,
 ) -> BaseResponse:
-    photo_: bytes | None = None
-    video_: bytes | None = None
-
-    if photo:
-        photo_ = await photo.read()
-    if video:
-        video_ = await video.read()
-
     await media_use_case.patch_media_block(
         block_uuid=block_id, telegram_user_id=current_user.telegram_id,
-        photo=photo_,
-        video=video_
+        photo=read_chunks(photo) if photo else None,
+        video=read_chunks(video) if video else None
     )
     return BaseResponse(
         message="Данные медиа-блока обновлены"
@@ -136,9 +214,18 @@ async def patch_block(
 
 
 
-@router.get("/{collection_uuid}/only_blocks")
+@router.get("/{collection_uuid}/only_blocks", response_model=MediaBlocksPage)
 async def get_collection_blocks(
     collection_uuid: UUID,
-    media_use_case: MediaUseCaseAnnotated
-) -> list[MediaBlock]:
-    return await media_use_case.get_collection_media_blocks(collection_uuid)
\ No newline at end of file
+    request: Request,
+    media_use_case: MediaUseCaseAnnotated,
+    limit: int | None = Query(default=None, ge=1),
+    cursor: str | None = Query(default=None)
+) -> Response:
+    version = await media_use_case.get_collection_version(collection_uuid=collection_uuid)
+    headers = _collection_cache_headers(version)
+    if not_modified(request.headers, headers["etag"]):
+        return Response(status_code=304, headers=headers)
+    return ModelResponse(await media_use_case.get_collection_media_blocks(
+        collection_uuid, limit=limit, cursor=cursor, version=version
+    ), headers=headers)
\ No newline at end of file
@@ -0,0 +1,73 @@
+from db.pool_metrics import pools
+from depends import collection_cache, collection_single_flight
+from fastapi import APIRouter
+from monitoring.metrics import REGISTRY, CONTENT_TYPE, Gauge, Counter, Metric
+from starlette.responses import Response
+
+router = APIRouter(prefix="/metrics", tags=["Метрики"], include_in_schema=False)
+
+
+def collect_db_pools() -> list[Metric]:
+    metrics = {
+        "checked_out": Gauge("db_pool_checked_out_connections", "Выданные из пула соединения", ("pool",)),
+        "idle": Gauge("db_pool_idle_connections", "Свободные соединения в пуле", ("pool",)),
+        "overflow": Gauge("db_pool_overflow_connections", "Соединения сверх pool_size", ("pool",)),
+        "checkouts": Counter("db_pool_checkouts_total", "Выдачи соединений из пула", ("pool",)),
+        "checkout_wait_seconds_total": Counter(
+            "db_pool_checkout_wait_seconds_total", "Суммарное ожидание свободного соединения", ("pool",)
+        ),
+        "overflow_events": Counter("db_pool_overflow_events_total", "Открытия соединений сверх pool_size", ("pool",)),
+        "checkout_timeouts": Counter("db_pool_checkout_timeouts_total", "Таймауты ожидания соединения", ("pool",)),
+    }
+    for pool in pools.values():
+        snapshot = pool.snapshot()
+        for key, metric in metrics.items():
+            metric.inc((pool.name,), snapshot[key])
+    return list(metrics.values())
+
+
+def collect_collection_cache() -> list[Metric]:
+    if not collection_cache:
+        return []
+    requests = Counter("collection_cache_requests_total", "Обращения к кешу коллекций", ("result",))
+    requests.inc(("hit",), collection_cache.stats.hits)
+    requests.inc(("miss",), collection_cache.stats.misses)
+    invalidations = Counter("collection_cache_invalidations_total", "Инвалидации кеша коллекций")
+    invalidations.inc(amount=collection_cache.stats.invalidations)
+    return [requests, invalidations]
+
+
+def collect_single_flight() -> list[Metric]:
+    stats = collection_single_flight.stats
+    calls = Counter(
+        "collection_single_flight_calls_total", "Чтения коллекций: сами пошли в базу или дождались чужой загрузки",
+        ("role",)
+    )
+    calls.inc(("leader",), stats.leaders)
+    calls.inc(("coalesced",), stats.coalesced)
+    in_flight = Gauge("collection_single_flight_in_flight", "Выполняющиеся сейчас загрузки коллекций")
+    in_flight.set((), stats.in_flight)
+    return [calls, in_flight]
+
+
+REGISTRY.register_collector(collect_db_pools)
+REGISTRY.register_collector(collect_collection_cache)
+REGISTRY.register_collector(collect_single_flight)
+
+
+@router.get("")
+async def get_metrics() -> Response:
+    return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE)
+
+
+@router.get("/cache")
+async def get_cache_metrics() -> dict:
+    single_flight = collection_single_flight.stats.as_dict()
+    if not collection_cache:
+        return {"enabled": False, "single_flight": single_flight}
+    return {"enabled": True, **collection_cache.stats.as_dict(), "single_flight": single_flight}
+
+
+@router.get("/db_pool")
+async def get_db_pool_metrics() -> list[dict]:
+    return [metrics.snapshot() for metrics in pools.values()]
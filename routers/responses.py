@@ -0,0 +1,165 @@
+import logging
+import os
+from email.utils import formatdate, parsedate_to_datetime
+
+import aiofiles
+import anyio
+from config import settings
+from exceptions.core import RangeNotSatisfiable
+from pydantic import BaseModel
+from services.bundle import TarBundle
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.types import Scope, Receive, Send
+
+logger = logging.getLogger(__name__)
+
+ZEROCOPY_EXTENSION = "http.response.zerocopysend"
+
+
+def parse_range(range_header: str | None, size: int) -> tuple[int, int] | None:
+    # Возвращает (start, end) включительно для одного диапазона "bytes=...".
+    # Несколько диапазонов и неизвестные единицы игнорируем - отдаем файл целиком,
+    # а нечитаемый или недостижимый диапазон байт - 416
+    if not range_header:
+        return None
+    unit, _, ranges = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+    start_, _, end_ = ranges.strip().partition("-")
+    try:
+        if not start_:
+            suffix = int(end_)
+            if suffix <= 0:
+                raise RangeNotSatisfiable(size=size)
+            return max(size - suffix, 0), size - 1
+        start = int(start_)
+        end = int(end_) if end_ else size - 1
+    except ValueError:
+        raise RangeNotSatisfiable(size=size)
+    if start >= size or start > end:
+        raise RangeNotSatisfiable(size=size)
+    return start, min(end, size - 1)
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+def not_modified(headers: Headers, etag: str, last_modified: float | None = None) -> bool:
+    if "if-none-match" in headers:
+        return etag_matches(headers["if-none-match"], etag)
+    if last_modified is not None and "if-modified-since" in headers:
+        try:
+            since = parsedate_to_datetime(headers["if-modified-since"]).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(last_modified) <= since
+    return False
+
+
+def range_allowed(headers: Headers, etag: str) -> bool:
+    # If-Range: диапазон применяем только если клиент докачивает ту же версию файла
+    if_range = headers.get("if-range")
+    return not if_range or if_range.strip() == etag
+
+
+class MediaFileResponse(Response):
+    chunk_size: int = settings.storage.chunk_size
+
+    def __init__(self, path: str, stat_result: os.stat_result, request_headers: Headers,
+                 etag: str, media_type: str | None = None, headers: dict | None = None,
+                 send_body: bool = True):
+        super().__init__(status_code=200, headers=headers, media_type=media_type)
+        self.path = path
+        self.send_body = send_body
+        size = stat_result.st_size
+        self.start, self.end = 0, size - 1
+
+        byte_range = parse_range(request_headers.get("range"), size) if range_allowed(request_headers, etag) else None
+        if byte_range:
+            self.start, self.end = byte_range
+            self.status_code = 206
+            self.headers["content-range"] = f"bytes {self.start}-{self.end}/{size}"
+
+        self.headers["content-length"] = str(self.end - self.start + 1)
+        self.headers["accept-ranges"] = "bytes"
+        self.headers["etag"] = etag
+        self.headers["last-modified"] = formatdate(stat_result.st_mtime, usegmt=True)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        count = self.end - self.start + 1
+        if not self.send_body or count <= 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        if ZEROCOPY_EXTENSION in scope.get("extensions", {}):
+            # Сервер сам отдает файл через sendfile, данные не проходят через Python
+            file = await anyio.to_thread.run_sync(open, self.path, "rb")
+            try:
+                await send({
+                    "type": ZEROCOPY_EXTENSION, "file": file,
+                    "offset": self.start, "count": count, "more_body": False
+                })
+            finally:
+                await anyio.to_thread.run_sync(file.close)
+            return
+
+        async with aiofiles.open(self.path, "rb") as f:
+            await f.seek(self.start)
+            while count > 0:
+                chunk = await f.read(min(self.chunk_size, count))
+                if not chunk:
+                    break
+                count -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": count > 0})
+        if count > 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+class ModelResponse(Response):
+    # Схема, собранная без валидации (model_construct), сериализуется сразу в JSON-байты
+    # сериализатором pydantic-core. FastAPI не валидирует повторно то, что вернули как Response,
+    # поэтому схему ответа для документации задаем в response_model
+    media_type = "application/json"
+
+    def render(self, content: BaseModel) -> bytes:
+        return content.__pydantic_serializer__.to_json(content, by_alias=True)
+
+
+
+class BundleResponse(Response):
+    # Потоковая отдача TarBundle с поддержкой Range: прерванную загрузку можно докачать
+    media_type = "application/x-tar"
+
+    def __init__(self, bundle: TarBundle, request_headers: Headers, etag: str, headers: dict | None = None):
+        super().__init__(status_code=200, headers=headers)
+        self.bundle = bundle
+        self.start, self.end = 0, bundle.size - 1
+
+        byte_range = parse_range(request_headers.get("range"), bundle.size) \
+            if range_allowed(request_headers, etag) else None
+        if byte_range:
+            self.start, self.end = byte_range
+            self.status_code = 206
+            self.headers["content-range"] = f"bytes {self.start}-{self.end}/{bundle.size}"
+
+        self.headers["content-length"] = str(self.end - self.start + 1)
+        self.headers["accept-ranges"] = "bytes"
+        self.headers["etag"] = etag
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        try:
+            async for chunk in self.bundle.iter_range(self.start, self.end):
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        except (EOFError, FileNotFoundError) as e:
+            # Файл обрезали или удалили сборщиком после разметки архива. Заголовки уже отправлены -
+            # завершаем ответ раньше Content-Length, клиент увидит обрыв и докачает архив заново
+            logger.warning("bundle truncated: %s", e)
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
@@ -0,0 +1,117 @@
+import base64
+import binascii
+from email.utils import formatdate
+from typing import Annotated
+from uuid import UUID
+
+from depends import CurrentUserAnnotated, UploadSessionServiceAnnotated
+from fastapi import APIRouter, Header, HTTPException, Request
+from monitoring.routing import ProfiledRoute
+from routers.responses import ModelResponse
+from schemas.media_collections import UploadSessionResponse
+from services.file_storage import FileStorageService, FileType
+from services.upload_sessions import UploadSession
+from starlette.responses import Response
+
+# Докачка файлов по протоколу tus 1.0 (core + creation, expiration, termination).
+# Готовые загрузки превращаются в медиа-блок через POST /collections/{id}/media_blocks/from_uploads
+router = APIRouter(prefix="/uploads", tags=["Загрузки"], route_class=ProfiledRoute)
+
+TUS_VERSION = "1.0.0"
+TUS_EXTENSIONS = "creation,expiration,termination"
+OFFSET_CONTENT_TYPE = "application/offset+octet-stream"
+
+
+def _parse_metadata(upload_metadata: str | None) -> dict[str, str]:
+    # Upload-Metadata: "ключ base64-значение" через запятую
+    metadata = {}
+    for pair in (upload_metadata or "").split(","):
+        key, _, value = pair.strip().partition(" ")
+        if not key:
+            continue
+        try:
+            metadata[key] = base64.b64decode(value, validate=True).decode()
+        except (binascii.Error, UnicodeDecodeError):
+            raise HTTPException(status_code=400, detail="Невалидный Upload-Metadata")
+    return metadata
+
+
+def _session_headers(session: UploadSession) -> dict[str, str]:
+    return {
+        "Tus-Resumable": TUS_VERSION,
+        "Upload-Offset": str(session.offset),
+        "Upload-Length": str(session.length),
+        "Upload-Expires": formatdate(session.expires_at, usegmt=True),
+        "Cache-Control": "no-store",
+    }
+
+
+@router.options("")
+async def get_upload_options() -> Response:
+    return Response(status_code=204, headers={
+        "Tus-Resumable": TUS_VERSION,
+        "Tus-Version": TUS_VERSION,
+        "Tus-Extension": TUS_EXTENSIONS,
+        "Tus-Max-Size": str(max(FileStorageService.max_sizes.values())),
+    })
+
+
+@router.post("", status_code=201, response_model=UploadSessionResponse)
+async def create_upload(
+    request: Request,
+    current_user: CurrentUserAnnotated,
+    upload_sessions: UploadSessionServiceAnnotated,
+    upload_length: Annotated[int, Header(alias="Upload-Length", ge=0)],
+    upload_metadata: Annotated[str | None, Header(alias="Upload-Metadata")] = None
+) -> Response:
+    # Тип файла - в Upload-Metadata: "file_type <base64 от photo или video>"
+    file_type = _parse_metadata(upload_metadata).get("file_type")
+    if file_type not in FileType.__members__:
+        raise HTTPException(status_code=400, detail="В Upload-Metadata нужен file_type: photo или video")
+    session = await upload_sessions.create_session(
+        telegram_user_id=current_user.telegram_id, file_type=FileType(file_type), length=upload_length
+    )
+    headers = _session_headers(session)
+    headers["Location"] = str(request.url_for("get_upload_offset", upload_id=session.id))
+    return ModelResponse(UploadSessionResponse(
+        id=session.id, offset=session.offset, length=session.length, expires_at=session.expires_at
+    ), status_code=201, headers=headers)
+
+
+@router.head("/{upload_id}")
+async def get_upload_offset(
+    upload_id: UUID,
+    current_user: CurrentUserAnnotated,
+    upload_sessions: UploadSessionServiceAnnotated
+) -> Response:
+    session = await upload_sessions.get_session(upload_id=upload_id, telegram_user_id=current_user.telegram_id)
+    return Response(status_code=200, headers=_session_headers(session))
+
+
+@router.patch("/{upload_id}")
+async def append_upload(
+    upload_id: UUID,
+    request: Request,
+    current_user: CurrentUserAnnotated,
+    upload_sessions: UploadSessionServiceAnnotated,
+    upload_offset: Annotated[int, Header(alias="Upload-Offset", ge=0)],
+    content_length: Annotated[int | None, Header(alias="Content-Length", ge=0)] = None
+) -> Response:
+    if request.headers.get("content-type") != OFFSET_CONTENT_TYPE:
+        raise HTTPException(status_code=415, detail=f"Content-Type должен быть {OFFSET_CONTENT_TYPE}")
+    # Тело читается из сокета кусками и сразу дописывается в файл сессии
+    session = await upload_sessions.append(
+        upload_id=upload_id, telegram_user_id=current_user.telegram_id,
+        offset=upload_offset, stream=request.stream(), content_length=content_length
+    )
+    return Response(status_code=204, headers=_session_headers(session))
+
+
+@router.delete("/{upload_id}")
+async def delete_upload(
+    upload_id: UUID,
+    current_user: CurrentUserAnnotated,
+    upload_sessions: UploadSessionServiceAnnotated
+) -> Response:
+    await upload_sessions.delete_session(upload_id=upload_id, telegram_user_id=current_user.telegram_id)
+    return Response(status_code=204, headers={"Tus-Resumable": TUS_VERSION})
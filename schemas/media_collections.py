@@ -7,6 +7,10 @@ class MediaBlock(BaseModel):
     id: UUID = Field(alias="uuid")
     photo_url: str
     video_url: str
+    photo_thumbnail_url: str | None = None
+    photo_webp_url: str | None = None
+    features_url: str | None = None
+    tracking_score: float | None = None
 
 
     class Config:
@@ -31,11 +35,49 @@ class CollectionResponse(CreatedCollectionResponse):
         from_attributes = True
 
 
+class CollectionsPage(BaseModel):
+    items: list[CollectionResponse]
+    next_cursor: str | None = None
+
+
+class MediaBlocksPage(BaseModel):
+    items: list[MediaBlock]
+    next_cursor: str | None = None
+
+
+class CollectionChanges(CreatedCollectionResponse):
+    # Изменения коллекции после версии since: добавленные и измененные блоки, uuid удаленных.
+    # full - ответ содержит все блоки (since=0), и локальную копию нужно заменить целиком
+    version: int
+    full: bool
+    blocks: list[MediaBlock] = []
+    deleted: list[UUID] = []
+
+
 class CreatedMediaBlockResponse(BaseModel):
     photo_url: str
     video_url: str
+    photo_thumbnail_url: str | None = None
+    photo_webp_url: str | None = None
+    features_url: str | None = None
+    tracking_score: float | None = None
+    # Блок коллекции с похожим фото (политика duplicate_marker_policy=warn)
+    similar_block_id: UUID | None = None
+    id: UUID
+
+
+
+class UploadSessionResponse(BaseModel):
     id: UUID
+    offset: int
+    length: int
+    expires_at: float
+
 
+class MediaBlockUploads(BaseModel):
+    # Завершенные загрузки (POST /uploads), из которых создается блок
+    photo_upload_id: UUID
+    video_upload_id: UUID
 
 
 class MediaBlockPatches(BaseModel):
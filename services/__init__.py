@@ -1,4 +1,5 @@
 from .file_storage import FileStorageServiceProtocol, FileStorageService
-from .auth_service import AuthService, AuthServiceProtocol
-from .telegram_auth import TelegramUtilsService, TelegramUtilsServiceProtocol
-from .qr_code_service import QrCodeServiceProtocol, QrCodeService
\ No newline at end of file
+from .auth_service import AuthService, AuthServiceProtocol, create_token_cache
+from .telegram_auth import TelegramUtilsService, TelegramUtilsServiceProtocol, create_init_data_cache
+from .qr_code_service import QrCodeServiceProtocol, QrCodeService, create_qr_code_cache
+from .photo_pipeline import PhotoPipelineServiceProtocol, PhotoPipelineService
\ No newline at end of file
@@ -0,0 +1,130 @@
+import struct
+from dataclasses import dataclass
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Файл признаков AR-метки (little-endian):
+#   заголовок: b"ARFT", версия u8, 1 байт выравнивания, ширина u16, высота u16, число точек u32, оценка f32
+#   точки: count * (x u16, y u16) в пикселях изображения ширина x высота
+#   дескрипторы: count * 32 байта (256-битный BRIEF)
+MAGIC = b"ARFT"
+VERSION = 1
+HEADER = struct.Struct("<4sBxHHIf")
+
+PATCH_SIZE = 31
+DESCRIPTOR_BITS = 256
+HARRIS_K = 0.04
+NMS_RADIUS = 3
+GRID_SIZE = 4
+# Стандартное отклонение яркости (0..1), начиная с которого контраст считается достаточным
+MIN_CONTRAST = 0.2
+
+# Пары точек BRIEF (dy1, dx1, dy2, dx2) внутри патча. Фиксированный seed входит в версию формата:
+# клиент строит те же пары, чтобы сравнивать дескрипторы кадра с дескрипторами метки
+BRIEF_PAIRS = np.clip(
+    np.round(np.random.default_rng(VERSION).normal(0, PATCH_SIZE / 5, size=(DESCRIPTOR_BITS, 4))),
+    -(PATCH_SIZE // 2), PATCH_SIZE // 2
+).astype(np.intp)
+
+
+@dataclass
+class ArFeatures:
+    width: int
+    height: int
+    keypoints: np.ndarray
+    descriptors: np.ndarray
+    score: float
+
+
+def _box_filter(image: np.ndarray, radius: int) -> np.ndarray:
+    # Среднее по окну (2 * radius + 1)^2 через интегральное изображение
+    size = 2 * radius + 1
+    integral = np.pad(
+        np.pad(image, radius, mode="edge").cumsum(axis=0, dtype=np.float64).cumsum(axis=1), ((1, 0), (1, 0))
+    )
+    return (
+        integral[size:, size:] - integral[:-size, size:] - integral[size:, :-size] + integral[:-size, :-size]
+    ) / (size * size)
+
+
+def _max_filter(image: np.ndarray, radius: int) -> np.ndarray:
+    # Максимум по окну, раздельно по строкам и столбцам
+    size = 2 * radius + 1
+    padded = np.pad(image, radius, mode="constant", constant_values=-np.inf)
+    rows = sliding_window_view(padded, size, axis=0).max(axis=-1)
+    return sliding_window_view(rows, size, axis=1).max(axis=-1)
+
+
+def _harris_response(image: np.ndarray) -> np.ndarray:
+    gy, gx = np.gradient(_box_filter(image, 1))
+    ixx = _box_filter(gx * gx, 2)
+    iyy = _box_filter(gy * gy, 2)
+    ixy = _box_filter(gx * gy, 2)
+    return ixx * iyy - ixy * ixy - HARRIS_K * (ixx + iyy) ** 2
+
+
+def _tracking_score(xs: np.ndarray, ys: np.ndarray, image: np.ndarray, target_keypoints: int) -> float:
+    # Трекабельность 0..1: достаточно ли углов, покрывают ли они всю картинку и хватает ли контраста
+    if not len(xs):
+        return 0.0
+    height, width = image.shape
+    density = min(len(xs) / target_keypoints, 1.0)
+    cells = (ys * GRID_SIZE // height) * GRID_SIZE + xs * GRID_SIZE // width
+    coverage = np.unique(cells).size / GRID_SIZE ** 2
+    contrast = min(float(image.std()) / MIN_CONTRAST, 1.0)
+    return density * coverage * contrast
+
+
+def extract_features(gray: np.ndarray, max_keypoints: int = 500) -> ArFeatures:
+    # gray - яркость uint8 (высота x ширина), уже уменьшенная до размера анализа
+    image = gray.astype(np.float32) / 255
+    height, width = image.shape
+    margin = PATCH_SIZE // 2 + 1
+    if min(height, width) <= 2 * margin:
+        # Патч дескриптора не помещается ни вокруг одной точки (а np.gradient падает на 1 x N):
+        # такое изображение - заведомо непригодная метка
+        return ArFeatures(
+            width=width, height=height, keypoints=np.empty((0, 2), dtype=np.uint16),
+            descriptors=np.empty((0, DESCRIPTOR_BITS // 8), dtype=np.uint8), score=0.0
+        )
+    response = _harris_response(image)
+
+    corners = (response == _max_filter(response, NMS_RADIUS)) & (response > max(response.max() * 0.01, 1e-6))
+    corners[:margin] = corners[-margin:] = False
+    corners[:, :margin] = corners[:, -margin:] = False
+
+    ys, xs = np.nonzero(corners)
+    strongest = np.argsort(response[ys, xs])[::-1][:max_keypoints]
+    ys, xs = ys[strongest], xs[strongest]
+
+    # Дескрипторы по сглаженному изображению: все точки и все пары одним индексированием
+    smooth = _box_filter(image, 2)
+    first = smooth[ys[:, None] + BRIEF_PAIRS[:, 0], xs[:, None] + BRIEF_PAIRS[:, 1]]
+    second = smooth[ys[:, None] + BRIEF_PAIRS[:, 2], xs[:, None] + BRIEF_PAIRS[:, 3]]
+
+    return ArFeatures(
+        width=width, height=height,
+        keypoints=np.stack([xs, ys], axis=1).astype(np.uint16),
+        descriptors=np.packbits(first < second, axis=1),
+        score=_tracking_score(xs, ys, image, target_keypoints=max(max_keypoints // 2, 1))
+    )
+
+
+def encode_features(features: ArFeatures) -> bytes:
+    return b"".join((
+        HEADER.pack(MAGIC, VERSION, features.width, features.height, len(features.keypoints), features.score),
+        features.keypoints.astype("<u2").tobytes(),
+        features.descriptors.astype(np.uint8).tobytes(),
+    ))
+
+
+def decode_features(data: bytes) -> ArFeatures:
+    magic, version, width, height, count, score = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Неизвестный формат файла признаков")
+    keypoints = np.frombuffer(data, dtype="<u2", count=count * 2, offset=HEADER.size).reshape(count, 2)
+    descriptors = np.frombuffer(
+        data, dtype=np.uint8, count=count * DESCRIPTOR_BITS // 8, offset=HEADER.size + keypoints.nbytes
+    ).reshape(count, DESCRIPTOR_BITS // 8)
+    return ArFeatures(width=width, height=height, keypoints=keypoints, descriptors=descriptors, score=score)
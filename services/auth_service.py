@@ -2,7 +2,10 @@ from typing import Protocol
 
 from exceptions.core import ExpiredToken, InvalidToken
 from schemas.auth import TokenData, TokensResponse
+from services.cache import TTLCache
 from datetime import datetime, timedelta
+import hashlib
+import time
 import jwt
 import json
 from config import settings
@@ -20,7 +23,15 @@ class AuthServiceProtocol(Protocol):
         ...
 
 
+def create_token_cache(maxsize: int = settings.auth_token_cache_size) -> TTLCache[bytes, TokenData]:
+    # Срок жизни записи задается exp токена, поэтому время - настенное
+    return TTLCache(maxsize=maxsize, timer=time.time)
+
+
 class AuthService(AuthServiceProtocol):
+    def __init__(self, token_cache: TTLCache[bytes, TokenData] | None = None):
+        self.token_cache = token_cache
+
     async def __create_access_token(self, sub: str):
         token_payload = {'sub': sub,
                          'exp': datetime.utcnow() + timedelta(days=30),
@@ -46,16 +57,26 @@ class AuthService(AuthServiceProtocol):
         )
 
     async def validate_token(self, access_token: str) -> TokenData:
+        # В кеше лежат только уже проверенные токены, ключ - sha256 токена, а не сам токен
+        token_key = hashlib.sha256(access_token.encode()).digest()
+        if self.token_cache is not None:
+            token_data = self.token_cache.get(token_key)
+            if token_data is not None:
+                return token_data
+
         try:
             payload = jwt.decode(access_token, settings.auth_secret_key, algorithms=['HS256'])
-            print(f'{payload=}')
             sub = json.loads(payload.get("sub"))
-            return TokenData(**sub)
+            token_data = TokenData(**sub)
         except jwt.ExpiredSignatureError:
             raise ExpiredToken
         except jwt.InvalidTokenError:
             raise InvalidToken
 
+        if self.token_cache is not None and "exp" in payload:
+            self.token_cache.set(token_key, token_data, expires_at=payload["exp"])
+        return token_data
+
     async def refresh_token(self, refresh_token: str) -> TokensResponse:
         try:
             payload = jwt.decode(refresh_token, settings.auth_secret_key, algorithms=['HS256'])
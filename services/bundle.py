@@ -0,0 +1,134 @@
+import asyncio
+import hashlib
+import json
+import os
+import tarfile
+from bisect import bisect_right
+from dataclasses import dataclass
+from typing import AsyncIterator
+
+import aiofiles
+import aiofiles.os
+
+from config import settings
+from schemas.media_collections import CollectionResponse
+from services.file_storage import FileStorageServiceProtocol
+
+MANIFEST_NAME = "manifest.json"
+MEDIA_DIR = "media"
+
+
+@dataclass
+class BundleSegment:
+    offset: int
+    size: int
+    data: bytes | None = None
+    path: str | None = None
+
+
+class TarBundle:
+    # Раскладка ustar-архива без сжатия: размер и смещение каждого куска известны заранее,
+    # поэтому архив отдается с любого байта (Range) прямо из файлов хранилища -
+    # без временных файлов и без сборки архива в памяти
+    def __init__(self):
+        self.segments: list[BundleSegment] = []
+        self.size = 0
+        self.__hasher = hashlib.sha256()
+
+    def __append(self, size: int, data: bytes | None = None, path: str | None = None) -> None:
+        if not size:
+            return
+        self.segments.append(BundleSegment(offset=self.size, size=size, data=data, path=path))
+        self.size += size
+        if data is not None:
+            self.__hasher.update(data)
+
+    def __add_header(self, name: str, size: int, mtime: float) -> None:
+        # Заголовок зависит только от имени, размера и mtime - одинаковый для одинакового содержимого
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = int(mtime)
+        info.mode = 0o644
+        header = info.tobuf(tarfile.USTAR_FORMAT, "utf-8", "strict")
+        self.__append(len(header), data=header)
+
+    def __add_padding(self, size: int) -> None:
+        padding = -size % tarfile.BLOCKSIZE
+        self.__append(padding, data=bytes(padding))
+
+    def add_bytes(self, name: str, data: bytes, mtime: float = 0) -> None:
+        self.__add_header(name, len(data), mtime)
+        self.__append(len(data), data=data)
+        self.__add_padding(len(data))
+
+    def add_file(self, name: str, path: str, stat_result: os.stat_result) -> None:
+        self.__add_header(name, stat_result.st_size, stat_result.st_mtime)
+        self.__append(stat_result.st_size, path=path)
+        self.__add_padding(stat_result.st_size)
+
+    def close(self) -> None:
+        # Конец архива - два пустых блока
+        self.__append(2 * tarfile.BLOCKSIZE, data=bytes(2 * tarfile.BLOCKSIZE))
+
+    @property
+    def etag(self) -> str:
+        # Все заголовки и манифест: меняется вместе с составом, размерами и mtime файлов
+        return self.__hasher.hexdigest()
+
+    async def iter_range(self, start: int, end: int,
+                         chunk_size: int = settings.storage.chunk_size) -> AsyncIterator[bytes]:
+        # Байты архива с start по end включительно
+        first = bisect_right([segment.offset for segment in self.segments], start) - 1
+        for segment in self.segments[max(first, 0):]:
+            if segment.offset > end:
+                break
+            lo = max(start, segment.offset) - segment.offset
+            hi = min(end + 1, segment.offset + segment.size) - segment.offset
+            if segment.data is not None:
+                yield segment.data[lo:hi]
+                continue
+            async with aiofiles.open(segment.path, "rb") as f:
+                await f.seek(lo)
+                remaining = hi - lo
+                while remaining > 0:
+                    chunk = await f.read(min(chunk_size, remaining))
+                    if not chunk:
+                        # Файл изменился после того, как архив был размечен
+                        raise EOFError(f"{segment.path} is shorter than expected")
+                    remaining -= len(chunk)
+                    yield chunk
+
+
+async def build_collection_bundle(collection: CollectionResponse,
+                                  file_storage_service: FileStorageServiceProtocol) -> TarBundle:
+    # manifest.json (коллекция и соответствие url -> файл в архиве), затем фото, видео и признаки меток
+    urls = list(dict.fromkeys(
+        url
+        for block in collection.blocks
+        for url in (block.photo_url, block.video_url, block.features_url)
+        if url
+    ))
+    paths = [file_storage_service.get_path_by_url(url) for url in urls]
+    stats = await asyncio.gather(*(aiofiles.os.stat(path) for path in paths), return_exceptions=True)
+
+    files = {}
+    bundle = TarBundle()
+    entries = []
+    for url, path, stat_result in zip(urls, paths, stats):
+        if isinstance(stat_result, FileNotFoundError):
+            continue
+        if isinstance(stat_result, BaseException):
+            raise stat_result
+        name = f'{MEDIA_DIR}/{file_storage_service.get_filename_by_url(url)}'
+        files[url] = name
+        entries.append((name, path, stat_result))
+
+    manifest = json.dumps(
+        dict(collection=collection.model_dump(mode="json", by_alias=True), files=files),
+        ensure_ascii=False, sort_keys=True, separators=(",", ":")
+    ).encode()
+    bundle.add_bytes(MANIFEST_NAME, manifest)
+    for name, path, stat_result in entries:
+        bundle.add_file(name, path, stat_result)
+    bundle.close()
+    return bundle
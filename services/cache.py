@@ -0,0 +1,55 @@
+import time
+from collections import OrderedDict
+from typing import Generic, TypeVar, Callable, Hashable
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class TTLCache(Generic[K, V]):
+    # LRU-кеш ограниченного размера, у каждой записи свой срок жизни.
+    # Не потокобезопасен: рассчитан на использование из одного event loop
+    def __init__(self, maxsize: int, ttl: float | None = None,
+                 timer: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self.__data: OrderedDict[K, tuple[float | None, V]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.__data)
+
+    def get(self, key: K, default: V | None = None) -> V | None:
+        item = self.__data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+        expires_at, value = item
+        if expires_at is not None and expires_at <= self.timer():
+            del self.__data[key]
+            self.misses += 1
+            return default
+        self.__data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: K, value: V, ttl: float | None = None, expires_at: float | None = None) -> None:
+        if self.maxsize <= 0:
+            return
+        if expires_at is None:
+            ttl = ttl if ttl is not None else self.ttl
+            expires_at = self.timer() + ttl if ttl is not None else None
+        self.__data[key] = (expires_at, value)
+        self.__data.move_to_end(key)
+        if len(self.__data) > self.maxsize:
+            # Истекшие записи удаляются при обращении, здесь - самая давно использованная
+            self.__data.popitem(last=False)
+
+    def pop(self, key: K, default: V | None = None) -> V | None:
+        item = self.__data.pop(key, None)
+        return item[1] if item is not None else default
+
+    def clear(self) -> None:
+        self.__data.clear()
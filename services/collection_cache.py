@@ -0,0 +1,124 @@
+import pickle
+import uuid
+from typing import Any, Awaitable, Callable, TypeVar
+from uuid import UUID
+
+from config import settings
+from services.cache import TTLCache
+from typing_extensions import Protocol
+
+T = TypeVar("T")
+
+
+class CacheBackendProtocol(Protocol):
+    async def get(self, key: str) -> Any | None:
+        ...
+
+    async def set(self, key: str, value: Any, ttl: float | None = None) -> None:
+        ...
+
+
+class InMemoryCacheBackend(CacheBackendProtocol):
+    # Кеш внутри процесса: у каждого воркера свой, устаревает не дольше чем за ttl
+    def __init__(self, maxsize: int, ttl: float):
+        self.__cache: TTLCache[str, Any] = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    async def get(self, key: str) -> Any | None:
+        return self.__cache.get(key)
+
+    async def set(self, key: str, value: Any, ttl: float | None = None) -> None:
+        self.__cache.set(key, value, ttl=ttl)
+
+
+class RedisCacheBackend(CacheBackendProtocol):
+    # Общий для всех воркеров кеш, требует установленного пакета redis
+    def __init__(self, url: str, ttl: float, prefix: str = "ar_api:"):
+        try:
+            from redis import asyncio as aioredis
+        except ImportError:
+            raise RuntimeError("Для CACHE_BACKEND=redis нужен пакет redis")
+        self.__redis = aioredis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    async def get(self, key: str) -> Any | None:
+        value = await self.__redis.get(self.prefix + key)
+        return pickle.loads(value) if value is not None else None
+
+    async def set(self, key: str, value: Any, ttl: float | None = None) -> None:
+        ttl = ttl if ttl is not None else self.ttl
+        await self.__redis.set(self.prefix + key, pickle.dumps(value), px=int(ttl * 1000) if ttl else None)
+
+
+class CacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def as_dict(self) -> dict[str, int]:
+        return dict(hits=self.hits, misses=self.misses, invalidations=self.invalidations)
+
+
+class CollectionCacheProtocol(Protocol):
+    stats: CacheStats
+
+    async def get_or_load(self, collection_uuid: UUID, key: str, loader: Callable[[], Awaitable[T]]) -> T:
+        ...
+
+    async def invalidate(self, collection_uuid: UUID) -> None:
+        ...
+
+
+class CollectionCache(CollectionCacheProtocol):
+    # Все записи коллекции лежат под ключами с ее текущей версией. Любое изменение коллекции
+    # заменяет версию на новую случайную, и старые записи больше не находятся (и вытесняются по ttl/LRU).
+    # Случайная, а не счетчик - чтобы потеря версии при вытеснении не воскресила старые записи
+    def __init__(self, backend: CacheBackendProtocol, version_ttl: float | None = None):
+        self.backend = backend
+        self.version_ttl = version_ttl
+        self.stats = CacheStats()
+
+    @staticmethod
+    def __version_key(collection_uuid: UUID) -> str:
+        return f'collection:{collection_uuid}:version'
+
+    async def __get_version(self, collection_uuid: UUID) -> str:
+        version = await self.backend.get(self.__version_key(collection_uuid))
+        if version is None:
+            version = await self.__new_version(collection_uuid)
+        return version
+
+    async def __new_version(self, collection_uuid: UUID) -> str:
+        version = uuid.uuid4().hex
+        await self.backend.set(self.__version_key(collection_uuid), version, ttl=self.version_ttl)
+        return version
+
+    async def get_or_load(self, collection_uuid: UUID, key: str, loader: Callable[[], Awaitable[T]]) -> T:
+        version = await self.__get_version(collection_uuid)
+        cache_key = f'collection:{collection_uuid}:{version}:{key}'
+        value = await self.backend.get(cache_key)
+        if value is not None:
+            self.stats.hits += 1
+            return value
+
+        self.stats.misses += 1
+        value = await loader()
+        await self.backend.set(cache_key, value)
+        return value
+
+    async def invalidate(self, collection_uuid: UUID) -> None:
+        self.stats.invalidations += 1
+        await self.__new_version(collection_uuid)
+
+
+def create_collection_cache() -> CollectionCache | None:
+    cache_settings = settings.cache
+    if cache_settings.backend == "none":
+        return None
+    if cache_settings.backend == "redis":
+        backend = RedisCacheBackend(url=cache_settings.url, ttl=cache_settings.ttl)
+        # Версии живут дольше записей, чтобы запись не пережила свою версию
+        return CollectionCache(backend, version_ttl=cache_settings.ttl * 2)
+    return CollectionCache(InMemoryCacheBackend(maxsize=cache_settings.size, ttl=cache_settings.ttl),
+                           version_ttl=cache_settings.ttl * 2)
@@ -1,28 +1,103 @@
+import asyncio
 import datetime
+import fcntl
+import hashlib
+import uuid
+from contextlib import contextmanager
 from enum import Enum
-from typing import Protocol
+from typing import Protocol, AsyncIterable, AsyncIterator
 
 import aiofiles
+import aiofiles.os
 import os
+import shutil
 from config import settings
+from exceptions.core import FileTooLarge, InvalidFileFormat
+from monitoring.profiler import span
 
 
 class FileType(str, Enum):
     photo = "photo"
     video = "video"
 
+
+# Сколько первых байт нужно для определения формата файла
+SIGNATURE_LENGTH = 16
+
+ALLOWED_FORMATS: dict[FileType, set[str]] = {
+    FileType.photo: {"jpg", "png", "webp", "heic"},
+    FileType.video: {"mp4", "mov", "webm"},
+}
+
+
+def detect_format(head: bytes) -> str | None:
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    if head[4:8] == b"ftyp":
+        brand = head[8:12]
+        if brand in (b"heic", b"heix", b"mif1", b"msf1"):
+            return "heic"
+        if brand == b"qt  ":
+            return "mov"
+        return "mp4"
+    if head.startswith(b"\x1a\x45\xdf\xa3"):
+        return "webm"
+    if head.lstrip().startswith((b"<?xml", b"<svg")):
+        return "svg"
+    if head.startswith(b"ARFT"):
+        return "arft"
+    return None
+
+
+def check_format(head: bytes, file_type: FileType) -> None:
+    if detect_format(head) not in ALLOWED_FORMATS[file_type]:
+        raise InvalidFileFormat
+
+
+async def read_chunks(file, chunk_size: int = settings.storage.chunk_size) -> AsyncIterator[bytes]:
+    # Читает файл с async read(size) (например, UploadFile) кусками, не загружая его целиком в память
+    while chunk := await file.read(chunk_size):
+        yield chunk
+
+
+async def _single_chunk(data: bytes) -> AsyncIterator[bytes]:
+    yield data
+
+
 class FileStorageServiceProtocol(Protocol):
     file_types = FileType
 
     async def save_file_get_url(self, file: bytes, filename: str | None = None) -> str:
         ...
 
+    async def save_stream_get_url(self, stream: AsyncIterable[bytes], filename: str | None = None,
+                                  file_type: FileType | None = None) -> str:
+        ...
+
+    async def save_local_file_get_url(self, path: str, filename: str | None = None,
+                                      file_type: FileType | None = None) -> str:
+        ...
+
     async def delete_file(self, filename: str) -> None:
         ...
 
     async def delete_file_by_url(self, url: str) -> None:
         ...
 
+    async def purge_file(self, filename: str, deadline: float | None = None) -> bool:
+        ...
+
+    @staticmethod
+    def get_filename_by_url(url: str) -> str:
+        ...
+
+    def get_path_by_url(self, url: str) -> str:
+        ...
+
     def format_filename(self, user_id: int, file_type: FileType) -> str:
         ...
 
@@ -32,30 +107,212 @@ class FileStorageService(FileStorageServiceProtocol):
     domain: str = settings.domain
     dir_path: str = settings.media_path
     media_url: str = "cdn"
+    max_sizes: dict[FileType, int] = {
+        FileType.photo: settings.storage.max_photo_size,
+        FileType.video: settings.storage.max_video_size,
+    }
+    # В режиме content-addressed файл называется по sha256 содержимого,
+    # а каждая ссылка на него - пустой файл в .refs/<имя файла>/
+    content_addressed: bool = settings.storage.content_addressed
+    refs_dir: str = ".refs"
 
     def __get_url(self, filename: str) -> str:
         return f'https://{self.domain}/{self.media_url}/{filename}'
 
-    async def __save_file_get_path(self, file: bytes, filename: str | None = None) -> str:
-        filename_ = str(round(datetime.datetime.now().timestamp()))
-        if filename:
-            filename_ += "_" + filename
+    async def __write_temp(self, stream: AsyncIterable[bytes],
+                           file_type: FileType | None = None) -> tuple[str, str | None, str | None]:
+        # Пишем во временный файл, который потом атомарно переименовывается,
+        # чтобы по url никогда не был виден недописанный файл
+        tmp_path = os.path.join(self.dir_path, f'.{uuid.uuid4().hex}.part')
+        max_size = self.max_sizes.get(file_type)
+        hasher = hashlib.sha256() if self.content_addressed else None
+        size = 0
+        head = b""
+        try:
+            async with aiofiles.open(tmp_path, "wb") as f:
+                async for chunk in stream:
+                    size += len(chunk)
+                    if max_size and size > max_size:
+                        raise FileTooLarge(max_size=max_size)
+                    if len(head) < SIGNATURE_LENGTH:
+                        head += chunk[:SIGNATURE_LENGTH - len(head)]
+                        if file_type and len(head) == SIGNATURE_LENGTH:
+                            check_format(head, file_type)
+                    if hasher:
+                        hasher.update(chunk)
+                    await f.write(chunk)
+            if file_type and len(head) < SIGNATURE_LENGTH:
+                check_format(head, file_type)
+        except BaseException:
+            await self.__remove_silently(tmp_path)
+            raise
+        return tmp_path, hasher.hexdigest() if hasher else None, detect_format(head)
+
+    @staticmethod
+    async def __remove_silently(path: str) -> None:
+        try:
+            await aiofiles.os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    @contextmanager
+    def __refs_lock(self):
+        # Межпроцессная блокировка: без нее удаление последней ссылки могло бы
+        # удалить файл, на который параллельно добавляется новая ссылка
+        refs_path = os.path.join(self.dir_path, self.refs_dir)
+        os.makedirs(refs_path, exist_ok=True)
+        with open(os.path.join(refs_path, ".lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield refs_path
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def __store_blob(self, tmp_path: str, filename: str) -> None:
+        with self.__refs_lock() as refs_path:
+            file_refs_path = os.path.join(refs_path, filename)
+            os.makedirs(file_refs_path, exist_ok=True)
+            open(os.path.join(file_refs_path, uuid.uuid4().hex), "x").close()
+
+            file_path = os.path.join(self.dir_path, filename)
+            if os.path.exists(file_path):
+                # Такой файл уже есть - повторно не сохраняем, но обновляем mtime:
+                # сборщик мусора не должен считать его старым и удалить
+                os.remove(tmp_path)
+                os.utime(file_path)
+            else:
+                os.replace(tmp_path, file_path)
+
+    def __release_blob(self, filename: str) -> bool:
+        # Удаляет одну ссылку на файл, сам файл - только вместе с последней ссылкой.
+        # Возвращает False, если файл хранится не в режиме content-addressed
+        with self.__refs_lock() as refs_path:
+            file_refs_path = os.path.join(refs_path, filename)
+            try:
+                refs = os.scandir(file_refs_path)
+            except FileNotFoundError:
+                return False
+            with refs:
+                ref = next(refs, None)
+            if ref:
+                os.remove(ref.path)
+            try:
+                os.rmdir(file_refs_path)
+            except OSError:
+                return True
+            try:
+                os.remove(os.path.join(self.dir_path, filename))
+            except FileNotFoundError:
+                pass
+            return True
+
+    def __inspect_file(self, path: str, file_type: FileType | None = None) -> tuple[str | None, str | None]:
+        # Те же проверки, что и при записи потока, для файла, который уже лежит в хранилище
+        max_size = self.max_sizes.get(file_type)
+        if max_size and os.path.getsize(path) > max_size:
+            raise FileTooLarge(max_size=max_size)
+        hasher = hashlib.sha256() if self.content_addressed else None
+        with open(path, "rb") as f:
+            head = f.read(SIGNATURE_LENGTH)
+            if file_type:
+                check_format(head, file_type)
+            if hasher:
+                hasher.update(head)
+                while chunk := f.read(settings.storage.chunk_size):
+                    hasher.update(chunk)
+        return hasher.hexdigest() if hasher else None, detect_format(head)
+
+    async def __save_file_get_path(self, stream: AsyncIterable[bytes], filename: str | None = None,
+                                   file_type: FileType | None = None) -> str:
+        tmp_path, digest, file_format = await self.__write_temp(stream, file_type)
+        return await self.__store(tmp_path, digest, file_format, filename)
 
-        file_path = os.path.join(self.dir_path, filename_)
-        async with aiofiles.open(file_path, "wb") as f:
-            await f.write(file)
-        return filename_
+    async def __store(self, tmp_path: str, digest: str | None, file_format: str | None,
+                      filename: str | None = None) -> str:
+        # Переносит готовый файл из tmp_path на его постоянное имя
+        try:
+            if digest:
+                filename_ = f'{digest}.{file_format}' if file_format else digest
+                await asyncio.to_thread(self.__store_blob, tmp_path, filename_)
+                return filename_
+
+            filename_ = str(round(datetime.datetime.now().timestamp()))
+            if filename:
+                filename_ += "_" + filename
+            await aiofiles.os.replace(tmp_path, os.path.join(self.dir_path, filename_))
+            return filename_
+        except BaseException:
+            await self.__remove_silently(tmp_path)
+            raise
 
     async def save_file_get_url(self, file: bytes, filename: str | None = None) -> str:
-        filename_ = await self.__save_file_get_path(file, filename)
+        return await self.save_stream_get_url(_single_chunk(file), filename)
+
+    async def save_stream_get_url(self, stream: AsyncIterable[bytes], filename: str | None = None,
+                                  file_type: FileType | None = None) -> str:
+        with span("storage"):
+            filename_ = await self.__save_file_get_path(stream, filename, file_type)
         return self.__get_url(filename=filename_)
 
+    async def save_local_file_get_url(self, path: str, filename: str | None = None,
+                                      file_type: FileType | None = None) -> str:
+        # Сохраняет файл из каталога хранилища (например, завершенную докачку) без копирования:
+        # только чтение для проверки формата и хеша, затем жесткая ссылка. Исходный файл остается на месте,
+        # и если медиа-блок потом не создастся, загрузку не придется повторять
+        with span("storage"):
+            digest, file_format = await asyncio.to_thread(self.__inspect_file, path, file_type)
+            tmp_path = os.path.join(self.dir_path, f'.{uuid.uuid4().hex}.part')
+            await asyncio.to_thread(os.link, path, tmp_path)
+            filename_ = await self.__store(tmp_path, digest, file_format, filename)
+        return self.__get_url(filename=filename_)
+
+    @staticmethod
+    def __changed_after(path: str, deadline: float) -> bool:
+        try:
+            return os.stat(path).st_mtime > deadline
+        except FileNotFoundError:
+            return False
+
+    def __purge_blob(self, filename: str, deadline: float | None = None) -> bool:
+        with self.__refs_lock() as refs_path:
+            file_refs_path = os.path.join(refs_path, filename)
+            if deadline is not None:
+                # Проверка под блокировкой ссылок: файл мог получить новую ссылку
+                # (повторная загрузка того же содержимого) уже после того, как его сочли ненужным
+                try:
+                    with os.scandir(file_refs_path) as refs:
+                        fresh_ref = any(ref.stat().st_mtime > deadline for ref in refs)
+                except FileNotFoundError:
+                    fresh_ref = False
+                if fresh_ref or self.__changed_after(os.path.join(self.dir_path, filename), deadline):
+                    return False
+            shutil.rmtree(file_refs_path, ignore_errors=True)
+            try:
+                os.remove(os.path.join(self.dir_path, filename))
+            except FileNotFoundError:
+                pass
+            return True
+
     async def delete_file(self, filename: str) -> None:
-        os.remove(path=os.path.join(self.dir_path, filename))
+        with span("storage"):
+            if await asyncio.to_thread(self.__release_blob, filename):
+                return
+            await aiofiles.os.remove(os.path.join(self.dir_path, filename))
 
     async def delete_file_by_url(self, url: str) -> None:
-        filename = url.split("/")[-1]
-        return await self.delete_file(filename=filename)
+        return await self.delete_file(filename=self.get_filename_by_url(url))
+
+    async def purge_file(self, filename: str, deadline: float | None = None) -> bool:
+        # Удаляет файл вместе со всеми ссылками на него, независимо от их числа.
+        # С deadline файл и ссылки, измененные позже deadline, не трогаются - тогда возвращает False
+        return await asyncio.to_thread(self.__purge_blob, filename, deadline)
+
+    @staticmethod
+    def get_filename_by_url(url: str) -> str:
+        return url.split("/")[-1]
+
+    def get_path_by_url(self, url: str) -> str:
+        return os.path.join(self.dir_path, self.get_filename_by_url(url))
 
     def format_filename(self, user_id: int, file_type: FileType) -> str:
-        return f'{user_id}_{file_type.value}'
\ No newline at end of file
+        return f'{user_id}_{file_type.value}'
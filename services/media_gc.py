@@ -0,0 +1,153 @@
+import argparse
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass, field, asdict
+from itertools import islice
+
+from config import settings
+from db.unit_of_work import UnitOfWorkProtocol
+from services.file_storage import FileStorageServiceProtocol
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class MediaGcReport:
+    dry_run: bool
+    scanned: int = 0
+    referenced: int = 0
+    skipped_recent: int = 0
+    deleted: int = 0
+    freed_bytes: int = 0
+    orphans: list[str] = field(default_factory=list)
+
+
+class MediaGarbageCollector:
+    # Сверяет файлы в каталоге хранилища со ссылками в базе и удаляет файлы, на которые никто не ссылается.
+    # Файлы моложе grace_period не трогаем: их могли только что загрузить, а строку в базе еще не закоммитить
+    lock_filename: str = ".gc.lock"
+
+    def __init__(self,
+                 uow: UnitOfWorkProtocol,
+                 file_storage_service: FileStorageServiceProtocol,
+                 dir_path: str = settings.media_path,
+                 batch_size: int = settings.media_gc.batch_size,
+                 grace_period: float = settings.media_gc.grace_period,
+                 deletes_per_second: float = settings.media_gc.deletes_per_second):
+        self.uow = uow
+        self.file_storage_service = file_storage_service
+        self.dir_path = dir_path
+        self.batch_size = batch_size
+        self.grace_period = grace_period
+        self.deletes_per_second = deletes_per_second
+
+    async def __load_referenced(self) -> set[str]:
+        async with self.uow as uow:
+            return {
+                self.file_storage_service.get_filename_by_url(url)
+                async for url in uow.media_collections.iter_media_urls(batch_size=self.batch_size)
+            }
+
+    async def __scan(self):
+        # os.scandir в отдельном потоке, по batch_size записей за раз
+        entries = await asyncio.to_thread(os.scandir, self.dir_path)
+        try:
+            while batch := await asyncio.to_thread(self.__read_batch, entries):
+                yield batch
+        finally:
+            entries.close()
+
+    def __read_batch(self, entries) -> list[tuple[str, int, float]]:
+        batch = []
+        for entry in islice(entries, self.batch_size):
+            if not entry.is_file(follow_symlinks=False):
+                continue
+            # Служебные файлы хранилища, кроме брошенных временных файлов загрузок
+            if entry.name.startswith(".") and not entry.name.endswith(".part"):
+                continue
+            stat_result = entry.stat(follow_symlinks=False)
+            batch.append((entry.name, stat_result.st_size, stat_result.st_mtime))
+        return batch
+
+    async def collect(self, dry_run: bool = False) -> MediaGcReport:
+        report = MediaGcReport(dry_run=dry_run)
+        # Ссылки читаем до сканирования: файл, появившийся позже, защищен grace_period
+        referenced = await self.__load_referenced()
+        report.referenced = len(referenced)
+        deadline = time.time() - self.grace_period
+
+        async for batch in self.__scan():
+            report.scanned += len(batch)
+            orphans = {name for name, _, _ in batch} - referenced
+            if not orphans:
+                continue
+            for name, size, mtime in batch:
+                if name not in orphans:
+                    continue
+                if mtime > deadline:
+                    report.skipped_recent += 1
+                    continue
+                if dry_run:
+                    report.orphans.append(name)
+                    report.freed_bytes += size
+                    continue
+                # mtime из сканирования мог устареть: перед удалением он перепроверяется под блокировкой ссылок
+                if not await self.file_storage_service.purge_file(name, deadline=deadline):
+                    report.skipped_recent += 1
+                    continue
+                report.orphans.append(name)
+                report.freed_bytes += size
+                report.deleted += 1
+                if self.deletes_per_second > 0:
+                    await asyncio.sleep(1 / self.deletes_per_second)
+        return report
+
+    def __try_lock(self):
+        # Из нескольких воркеров сборку одновременно выполняет только один
+        lock = open(os.path.join(self.dir_path, self.lock_filename), "a")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            return None
+        return lock
+
+    async def run_periodically(self, interval: float = settings.media_gc.interval) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            lock = await asyncio.to_thread(self.__try_lock)
+            if lock is None:
+                continue
+            try:
+                report = await self.collect()
+                logger.info("media gc: scanned=%s deleted=%s freed_bytes=%s",
+                            report.scanned, report.deleted, report.freed_bytes)
+            except Exception:
+                logger.exception("media gc failed")
+            finally:
+                lock.close()
+
+
+def create_media_garbage_collector() -> MediaGarbageCollector:
+    from depends import get_unit_of_work, get_file_storage_service
+    return MediaGarbageCollector(uow=get_unit_of_work(), file_storage_service=get_file_storage_service())
+
+
+async def main(dry_run: bool, grace_period: float) -> None:
+    collector = create_media_garbage_collector()
+    collector.grace_period = grace_period
+    report = await collector.collect(dry_run=dry_run)
+    print(json.dumps(asdict(report), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    # Разовый запуск: python -m services.media_gc [--dry-run] [--grace-period 3600]
+    parser = argparse.ArgumentParser(description="Удаление медиафайлов, на которые не ссылается база")
+    parser.add_argument("--dry-run", action="store_true", help="только отчет, без удаления")
+    parser.add_argument("--grace-period", type=float, default=settings.media_gc.grace_period)
+    args = parser.parse_args()
+    asyncio.run(main(dry_run=args.dry_run, grace_period=args.grace_period))
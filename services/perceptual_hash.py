@@ -0,0 +1,75 @@
+import math
+from typing import Generic, Hashable, Iterable, TypeVar
+
+import numpy as np
+
+# pHash: 64 бита из знаков низких частот DCT уменьшенной до 32x32 яркостной копии
+HASH_IMAGE_SIZE = 32
+HASH_SIZE = 8
+
+L = TypeVar("L", bound=Hashable)
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(math.pi * (2 * i + 1) * k / (2 * n)) * math.sqrt(2 / n)
+    matrix[0] /= math.sqrt(2)
+    return matrix
+
+
+DCT_MATRIX = _dct_matrix(HASH_IMAGE_SIZE)
+
+# Число единичных бит в каждом байте
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def phash(gray: np.ndarray) -> int:
+    # gray - яркость HASH_IMAGE_SIZE x HASH_IMAGE_SIZE. Результат - знаковое 64-битное число (как BIGINT в базе)
+    dct = DCT_MATRIX @ gray.astype(np.float64) @ DCT_MATRIX.T
+    low = dct[:HASH_SIZE, :HASH_SIZE].ravel()
+    # Постоянная составляющая в медиану не входит: она отражает только общую яркость
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), "big", signed=True)
+
+
+def hamming_distances(hashes: np.ndarray, value: int) -> np.ndarray:
+    # Расстояния от value до всех hashes (int64) за один проход: XOR и popcount
+    diff = np.bitwise_xor(hashes, np.int64(value)).view(np.uint64)
+    if hasattr(np, "bitwise_count"):
+        # NumPy 2: аппаратный popcount
+        return np.bitwise_count(diff)
+    return POPCOUNT[diff.view(np.uint8)].reshape(-1, 8).sum(axis=1, dtype=np.uint8)
+
+
+class PhashIndex(Generic[L]):
+    # Индекс хешей одной коллекции. Полный векторизованный перебор: для тысяч хешей
+    # это доли миллисекунды и, в отличие от BK-дерева, без обхода в Python
+    def __init__(self, hashes: Iterable[int] = (), labels: Iterable[L] = ()):
+        self.__buffer = np.fromiter(hashes, dtype=np.int64)
+        self.labels: list[L] = list(labels)
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    @property
+    def hashes(self) -> np.ndarray:
+        return self.__buffer[:len(self.labels)]
+
+    def add(self, value: int, label: L) -> None:
+        # Буфер растет удвоением, а не копированием на каждое добавление (как np.append):
+        # серия из n добавлений - O(n), а не O(n^2)
+        size = len(self.labels)
+        if size == len(self.__buffer):
+            buffer = np.empty(max(2 * size, 16), dtype=np.int64)
+            buffer[:size] = self.__buffer
+            self.__buffer = buffer
+        self.__buffer[size] = value
+        self.labels.append(label)
+
+    def nearest(self, value: int) -> tuple[L, int] | None:
+        if not self.labels:
+            return None
+        distances = hamming_distances(self.hashes, value)
+        i = int(distances.argmin())
+        return self.labels[i], int(distances[i])
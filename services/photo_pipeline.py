@@ -0,0 +1,148 @@
+import asyncio
+import io
+import logging
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from config import settings
+from exceptions.core import UnsuitableArTarget, ImageTooLarge
+from monitoring.profiler import span
+from services.ar_features import extract_features, encode_features
+from services.file_storage import FileStorageServiceProtocol
+from services.perceptual_hash import phash, HASH_IMAGE_SIZE
+from typing_extensions import Protocol
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PhotoDerivatives:
+    thumbnail: bytes
+    webp: bytes
+    features: bytes | None = None
+    tracking_score: float | None = None
+    phash: int | None = None
+
+
+# Колонки медиа-блока, которые заполняет конвейер; файлы - только в *_url
+DERIVATIVE_URL_FIELDS = ("photo_thumbnail_url", "photo_webp_url", "features_url")
+DERIVATIVE_FIELDS = (*DERIVATIVE_URL_FIELDS, "tracking_score", "photo_phash")
+
+
+def _encode(image: Image.Image, image_format: str, **params) -> bytes:
+    f = io.BytesIO()
+    image.save(f, format=image_format, **params)
+    return f.getvalue()
+
+
+# Функция уровня модуля, чтобы ее можно было отправить в пул процессов.
+# Фото декодируется один раз, все производные строятся из одного и того же изображения
+def process_photo(path: str,
+                  thumbnail_size: int = settings.photo_pipeline.thumbnail_size,
+                  webp_quality: int = settings.photo_pipeline.webp_quality,
+                  jpeg_quality: int = settings.photo_pipeline.jpeg_quality,
+                  max_pixels: int = settings.photo_pipeline.max_pixels,
+                  ar_features: bool = settings.photo_pipeline.ar_features,
+                  ar_analysis_size: int = settings.photo_pipeline.ar_analysis_size,
+                  ar_max_keypoints: int = settings.photo_pipeline.ar_max_keypoints) -> PhotoDerivatives | None:
+    try:
+        with Image.open(path) as source:
+            # Размер известен из заголовка: проверяем до декодирования, которое заняло бы сотни мегабайт
+            if source.width * source.height > max_pixels:
+                raise ImageTooLarge(max_pixels=max_pixels)
+            image = ImageOps.exif_transpose(source).convert("RGB")
+    except Image.DecompressionBombError:
+        # Pillow сам отказывается открывать такие изображения; это не OSError
+        raise ImageTooLarge(max_pixels=max_pixels)
+    except (UnidentifiedImageError, OSError):
+        # Например, HEIC без плагина - блок сохраняется без производных
+        return None
+
+    thumbnail = image.copy()
+    thumbnail.thumbnail((thumbnail_size, thumbnail_size), Image.Resampling.LANCZOS)
+    derivatives = PhotoDerivatives(
+        thumbnail=_encode(thumbnail, "JPEG", quality=jpeg_quality, progressive=True, optimize=True),
+        webp=_encode(image, "WEBP", quality=webp_quality, method=4)
+    )
+
+    gray = image.convert("L")
+    derivatives.phash = phash(np.asarray(
+        gray.resize((HASH_IMAGE_SIZE, HASH_IMAGE_SIZE), Image.Resampling.LANCZOS)
+    ))
+
+    if ar_features:
+        # Признаки AR-метки считаются на уменьшенной яркостной копии - в разрешении, близком к кадру камеры
+        gray.thumbnail((ar_analysis_size, ar_analysis_size), Image.Resampling.BILINEAR)
+        features = extract_features(np.asarray(gray), max_keypoints=ar_max_keypoints)
+        derivatives.features = encode_features(features)
+        derivatives.tracking_score = features.score
+    return derivatives
+
+
+_executor: Executor | None = None
+
+
+def get_photo_executor() -> Executor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=settings.photo_pipeline.workers)
+    return _executor
+
+
+class PhotoPipelineServiceProtocol(Protocol):
+    async def create_derivatives(self, photo_url: str, telegram_user_id: int) -> dict[str, str | float | None]:
+        ...
+
+    async def create_derivatives_from_path(self, path: str, telegram_user_id: int) -> dict[str, str | float | None]:
+        ...
+
+
+class PhotoPipelineService(PhotoPipelineServiceProtocol):
+    def __init__(self,
+                 file_storage_service: FileStorageServiceProtocol,
+                 executor: Executor | None = None,
+                 min_tracking_score: float = settings.photo_pipeline.ar_min_tracking_score):
+        self.file_storage_service = file_storage_service
+        self.executor = executor
+        self.min_tracking_score = min_tracking_score
+
+    async def create_derivatives(self, photo_url: str, telegram_user_id: int) -> dict[str, str | float | None]:
+        return await self.create_derivatives_from_path(
+            self.file_storage_service.get_path_by_url(photo_url), telegram_user_id
+        )
+
+    async def create_derivatives_from_path(self, path: str, telegram_user_id: int) -> dict[str, str | float | None]:
+        # Возвращает значения колонок DERIVATIVE_FIELDS, None - если фото не удалось декодировать.
+        # path - любой файл, не обязательно уже сохраненный в хранилище (например, завершенная докачка)
+        loop = asyncio.get_running_loop()
+        with span("photo"):
+            derivatives: PhotoDerivatives | None = await loop.run_in_executor(
+                self.executor or get_photo_executor(), process_photo, path
+            )
+        if derivatives is None:
+            logger.info("photo derivatives skipped, cannot decode %s", path)
+            return dict.fromkeys(DERIVATIVE_FIELDS)
+        if derivatives.tracking_score is not None and derivatives.tracking_score < self.min_tracking_score:
+            raise UnsuitableArTarget(tracking_score=derivatives.tracking_score, min_score=self.min_tracking_score)
+
+        files = dict(
+            photo_thumbnail_url=(derivatives.thumbnail, f'{telegram_user_id}_photo_thumbnail.jpg'),
+            photo_webp_url=(derivatives.webp, f'{telegram_user_id}_photo.webp'),
+            features_url=(derivatives.features, f'{telegram_user_id}_photo.arft'),
+        )
+        result: dict[str, str | float | None] = dict.fromkeys(DERIVATIVE_FIELDS)
+        try:
+            for field, (data, filename) in files.items():
+                if data is not None:
+                    result[field] = await self.file_storage_service.save_file_get_url(file=data, filename=filename)
+        except BaseException:
+            for field in DERIVATIVE_URL_FIELDS:
+                if result[field]:
+                    await self.file_storage_service.delete_file_by_url(result[field])
+            raise
+        result["tracking_score"] = derivatives.tracking_score
+        result["photo_phash"] = derivatives.phash
+        return result
@@ -1,32 +1,91 @@
+import asyncio
 import io
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable
+
+from config import settings
+from monitoring.profiler import span
+from services.cache import TTLCache
 from typing_extensions import Protocol
 import segno
 import qrcode
+import qrcode.image.svg
 
 
 class QrCodeServiceProtocol(Protocol):
+    image_format: str
+
     async def create_qr_code(self, payload: str) -> bytes:
         ...
 
 
-class QrCodeService_(QrCodeServiceProtocol):
-    async def create_qr_code(self, payload: str) -> bytes:
-        qr = segno.make_qr(content=payload)
-        f = io.BytesIO()
-        qr.save(out=f)
-        f.seek(0)
+# Рендеры - функции уровня модуля, чтобы их можно было отправить в пул процессов
+def render_segno(payload: str, image_format: str) -> bytes:
+    qr = segno.make_qr(content=payload)
+    f = io.BytesIO()
+    qr.save(out=f, kind=image_format, scale=10, border=4)
+    return f.getvalue()
+
+
+def render_qrcode(payload: str, image_format: str) -> bytes:
+    qr = qrcode.QRCode()
+    qr.add_data(payload)
+    b = io.BytesIO()
+    if image_format == "svg":
+        qr.make_image(image_factory=qrcode.image.svg.SvgPathImage).save(b)
+    else:
+        qr.make_image().get_image().save(b, format=image_format)
+    return b.getvalue()
+
 
+RENDERERS: dict[str, Callable[[str, str], bytes]] = {
+    "segno": render_segno,
+    "qrcode": render_qrcode,
+}
 
-        return f.read()
+_executor: Executor | None = None
+
+
+def get_qr_code_executor() -> Executor:
+    # Пул создается при первом QR-коде, а не при импорте - уже внутри воркера uvicorn
+    global _executor
+    if _executor is None:
+        if settings.qr_code.executor == "thread":
+            _executor = ThreadPoolExecutor(max_workers=settings.qr_code.workers, thread_name_prefix="qr_code")
+        else:
+            _executor = ProcessPoolExecutor(max_workers=settings.qr_code.workers)
+    return _executor
+
+
+def create_qr_code_cache(maxsize: int = settings.qr_code.cache_size) -> TTLCache[tuple[str, str, str], bytes]:
+    return TTLCache(maxsize=maxsize)
 
 
 class QrCodeService(QrCodeServiceProtocol):
+    def __init__(self,
+                 backend: str = settings.qr_code.backend,
+                 image_format: str = settings.qr_code.image_format,
+                 executor: Executor | None = None,
+                 cache: TTLCache[tuple[str, str, str], bytes] | None = None):
+        self.render = RENDERERS[backend]
+        self.backend = backend
+        self.image_format = image_format
+        self.executor = executor
+        self.cache = cache
+
     async def create_qr_code(self, payload: str) -> bytes:
-        qr = qrcode.QRCode()
-        qr.add_data(payload)
-        img = qr.make_image()
-        image = img.get_image()
-        b = io.BytesIO()
-        image.save(b, format="png")
-        b.seek(0)
-        return b.read()
\ No newline at end of file
+        key = (self.backend, self.image_format, payload)
+        if self.cache is not None:
+            qr_code = self.cache.get(key)
+            if qr_code is not None:
+                return qr_code
+
+        # Рендер и кодирование PNG - чистый CPU, в event loop он блокировал бы все запросы воркера
+        loop = asyncio.get_running_loop()
+        with span("qr"):
+            qr_code = await loop.run_in_executor(
+                self.executor or get_qr_code_executor(), self.render, payload, self.image_format
+            )
+        if self.cache is not None:
+            self.cache.set(key, qr_code)
+        return qr_code
@@ -0,0 +1,48 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Generic, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlightStats:
+    def __init__(self):
+        self.leaders = 0
+        self.coalesced = 0
+        self.in_flight = 0
+
+    def as_dict(self) -> dict[str, int]:
+        return dict(leaders=self.leaders, coalesced=self.coalesced, in_flight=self.in_flight)
+
+
+class SingleFlight(Generic[T]):
+    # Одинаковые одновременные загрузки внутри воркера: первая (лидер) выполняется в отдельной задаче,
+    # остальные ждут ее результат. Задача защищена shield: отключившийся клиент-лидер
+    # не отменяет загрузку для тех, кто к ней присоединился
+    def __init__(self):
+        self.__calls: dict[Hashable, asyncio.Task] = {}
+        self.stats = SingleFlightStats()
+
+    async def do(self, key: Hashable, loader: Callable[[], Awaitable[T]]) -> T:
+        task = self.__calls.get(key)
+        if task is None:
+            self.stats.leaders += 1
+            task = self.__calls[key] = asyncio.ensure_future(self.__run(key, loader))
+            task.add_done_callback(self.__consume_exception)
+        else:
+            self.stats.coalesced += 1
+        return await asyncio.shield(task)
+
+    async def __run(self, key: Hashable, loader: Callable[[], Awaitable[T]]) -> T:
+        self.stats.in_flight += 1
+        try:
+            return await loader()
+        finally:
+            self.stats.in_flight -= 1
+            # Результат не кешируется: следующий запрос после завершения снова идет в loader
+            self.__calls.pop(key, None)
+
+    @staticmethod
+    def __consume_exception(task: asyncio.Task) -> Any:
+        # Если все ожидающие отменены, ошибку никто не заберет - не даем asyncio ругаться на это в лог
+        if not task.cancelled():
+            task.exception()
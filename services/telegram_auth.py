@@ -1,9 +1,11 @@
-from urllib.parse import unquote
+from functools import lru_cache
+from urllib.parse import parse_qsl
 import hmac
 import json
 import hashlib
 from exceptions.core import InvalidInitDataException
-from schemas.auth import UserDataFromInitData
+from schemas.auth import UserDataFromInitData, TokensResponse
+from services.cache import TTLCache
 from config import settings
 from typing_extensions import Protocol
 
@@ -11,29 +13,46 @@ from typing_extensions import Protocol
 class TelegramUtilsServiceProtocol(Protocol):
     async def verify_telegram_init_data(self, init_data: str) -> UserDataFromInitData:
         ...
+    def get_init_data_hash(self, init_data: str) -> str | None:
+        ...
     async def create_startup_url(self, payload: str) -> str:
         ...
 
+
+@lru_cache(maxsize=8)
+def get_secret_key(bot_token: str) -> bytes:
+    # Ключ зависит только от токена бота - считаем один раз
+    return hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+
+
+def create_init_data_cache(ttl: int = settings.telegram_init_data_cache_ttl,
+                           maxsize: int = 10000) -> TTLCache[str, tuple[bytes, TokensResponse]]:
+    # Ключ - hash из init data, значение - (sha256 всей init data, выданные токены)
+    return TTLCache(maxsize=maxsize if ttl > 0 else 0, ttl=ttl)
+
+
 class TelegramUtilsService:
     bot_token: str = settings.telegram_bot_token
 
     async def verify_telegram_init_data(self, init_data: str) -> UserDataFromInitData:
         try:
-            vals = {k: unquote(v) for k, v in [s.split('=', 1) for s in init_data.split('&')]}
-            print(f'{vals=}')
+            vals = dict(parse_qsl(init_data, keep_blank_values=True, strict_parsing=True))
             data_check_string = '\n'.join(f"{k}={v}" for k, v in sorted(vals.items()) if k != 'hash')
-            print(f'{data_check_string=}')
 
-            secret_key = hmac.new("WebAppData".encode(), self.bot_token.encode(), hashlib.sha256).digest()
-            h = hmac.new(secret_key, data_check_string.encode(), hashlib.sha256)
-            if h.hexdigest() == vals['hash']:
+            h = hmac.new(get_secret_key(self.bot_token), data_check_string.encode(), hashlib.sha256)
+            if hmac.compare_digest(h.hexdigest(), vals['hash']):
                 return UserDataFromInitData(**json.loads(vals.get("user")))
         except:
             raise InvalidInitDataException
 
         raise InvalidInitDataException
 
+    def get_init_data_hash(self, init_data: str) -> str | None:
+        for key, value in parse_qsl(init_data, keep_blank_values=True):
+            if key == "hash":
+                return value
+        return None
 
     async def create_startup_url(self, payload: str) -> str:
         url = f"https://t.me/"
-        return url
\ No newline at end of file
+        return url
@@ -0,0 +1,247 @@
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Protocol, AsyncIterable
+from uuid import UUID
+
+import aiofiles
+
+from config import settings
+from exceptions.core import EntityNotFound, FileTooLarge, InvalidFileFormat, UploadOffsetMismatch, \
+    UploadIncomplete
+from services.file_storage import FileStorageService, FileType, SIGNATURE_LENGTH, check_format
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class UploadSession:
+    id: UUID
+    telegram_user_id: int
+    file_type: FileType
+    length: int
+    offset: int
+    expires_at: float
+
+
+class UploadSessionServiceProtocol(Protocol):
+
+    async def create_session(self, telegram_user_id: int, file_type: FileType, length: int) -> UploadSession:
+        ...
+
+    async def get_session(self, upload_id: UUID, telegram_user_id: int) -> UploadSession:
+        ...
+
+    async def append(self, upload_id: UUID, telegram_user_id: int, offset: int,
+                     stream: AsyncIterable[bytes], content_length: int | None = None) -> UploadSession:
+        ...
+
+    async def get_completed_path(self, upload_id: UUID, telegram_user_id: int,
+                                 file_type: FileType | None = None) -> str:
+        ...
+
+    async def delete_session(self, upload_id: UUID, telegram_user_id: int) -> None:
+        ...
+
+    async def purge_expired(self) -> int:
+        ...
+
+
+class UploadSessionService(UploadSessionServiceProtocol):
+    # Докачка больших файлов по частям (в духе tus). Сессия - два файла в .uploads/ каталога хранилища:
+    # <id>.json с метаданными и <id> с уже полученными байтами. Смещение - размер файла с данными,
+    # а срок жизни отсчитывается от его mtime, поэтому каждый PATCH продлевает сессию без перезаписи json.
+    # Каталог тот же, что у хранилища: готовый файл забирается в него переименованием, без копирования
+    dir_path: str = os.path.join(settings.media_path, ".uploads")
+    max_sizes: dict[FileType, int] = FileStorageService.max_sizes
+
+    def __init__(self, ttl: float = settings.storage.upload_session_ttl):
+        self.ttl = ttl
+
+    def __data_path(self, upload_id: UUID) -> str:
+        return os.path.join(self.dir_path, upload_id.hex)
+
+    def __meta_path(self, upload_id: UUID) -> str:
+        return os.path.join(self.dir_path, f'{upload_id.hex}.json')
+
+    def __create(self, session: UploadSession) -> None:
+        os.makedirs(self.dir_path, exist_ok=True)
+        # Сначала данные, потом метаданные: сессия без json не видна и будет удалена по сроку
+        open(self.__data_path(session.id), "xb").close()
+        with open(self.__meta_path(session.id), "x") as f:
+            json.dump(dict(telegram_user_id=session.telegram_user_id,
+                           file_type=session.file_type.value, length=session.length), f)
+
+    async def create_session(self, telegram_user_id: int, file_type: FileType, length: int) -> UploadSession:
+        max_size = self.max_sizes[file_type]
+        if length > max_size:
+            raise FileTooLarge(max_size=max_size)
+        session = UploadSession(
+            id=uuid.uuid4(), telegram_user_id=telegram_user_id, file_type=file_type,
+            length=length, offset=0, expires_at=time.time() + self.ttl
+        )
+        await asyncio.to_thread(self.__create, session)
+        return session
+
+    def __read_meta(self, upload_id: UUID) -> dict | None:
+        try:
+            with open(self.__meta_path(upload_id)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def __load(self, upload_id: UUID) -> UploadSession | None:
+        meta = self.__read_meta(upload_id)
+        if not meta:
+            return None
+        try:
+            stat_result = os.stat(self.__data_path(upload_id))
+        except FileNotFoundError:
+            return None
+        return UploadSession(
+            id=upload_id, telegram_user_id=meta["telegram_user_id"], file_type=FileType(meta["file_type"]),
+            length=meta["length"], offset=stat_result.st_size, expires_at=stat_result.st_mtime + self.ttl
+        )
+
+    async def get_session(self, upload_id: UUID, telegram_user_id: int) -> UploadSession:
+        session = await asyncio.to_thread(self.__load, upload_id)
+        # Чужая и просроченная сессии для клиента не отличаются от несуществующей
+        if not session or session.telegram_user_id != telegram_user_id or session.expires_at < time.time():
+            raise EntityNotFound(entity="upload", by_field="id")
+        return session
+
+    async def __read_head(self, upload_id: UUID, size: int) -> bytes | None:
+        # None - первые байты уже получены и проверены предыдущими PATCH
+        if size >= SIGNATURE_LENGTH:
+            return None
+        async with aiofiles.open(self.__data_path(upload_id), "rb") as f:
+            return await f.read(size)
+
+    async def append(self, upload_id: UUID, telegram_user_id: int, offset: int,
+                     stream: AsyncIterable[bytes], content_length: int | None = None) -> UploadSession:
+        session = await self.get_session(upload_id, telegram_user_id)
+        if offset != session.offset:
+            raise UploadOffsetMismatch(offset=session.offset)
+        # Лишние байты видны по Content-Length еще до чтения тела - сессию не трогаем
+        if content_length is not None and offset + content_length > session.length:
+            raise FileTooLarge(max_size=session.length)
+
+        # r+b, а не ab: файл, удаленный вместе с просроченной сессией, не должен создаться заново.
+        # Без буфера: каждый кусок сразу уходит в файл, и при обрыве соединения полученное не теряется
+        async with aiofiles.open(self.__data_path(upload_id), "r+b", buffering=0) as f:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Предыдущий PATCH этой сессии еще пишет: смещение вот-вот изменится
+                raise UploadOffsetMismatch(offset=session.offset)
+            stat_result = os.fstat(f.fileno())
+            if stat_result.st_nlink == 0:
+                raise EntityNotFound(entity="upload", by_field="id")
+            if stat_result.st_size != offset:
+                raise UploadOffsetMismatch(offset=stat_result.st_size)
+            await f.seek(offset)
+
+            # Формат проверяется по первым байтам файла, даже если они пришли в разных PATCH
+            head = await self.__read_head(upload_id, offset)
+            try:
+                async for chunk in stream:
+                    if session.offset + len(chunk) > session.length:
+                        raise FileTooLarge(max_size=session.length)
+                    if head is not None and len(head) < SIGNATURE_LENGTH:
+                        head += chunk[:SIGNATURE_LENGTH - len(head)]
+                        if len(head) == SIGNATURE_LENGTH or session.offset + len(chunk) == session.length:
+                            check_format(head, session.file_type)
+                    view = memoryview(chunk)
+                    while view:
+                        written = await f.write(view)
+                        view = view[written:]
+                        session.offset += written
+            except (FileTooLarge, InvalidFileFormat):
+                # Тело без Content-Length (chunked) проверяется по ходу: отказ отменяет весь PATCH,
+                # уже записанные куски этого запроса отрезаются
+                await f.truncate(offset)
+                raise
+        session.expires_at = time.time() + self.ttl
+        return session
+
+    async def get_completed_path(self, upload_id: UUID, telegram_user_id: int,
+                                 file_type: FileType | None = None) -> str:
+        session = await self.get_session(upload_id, telegram_user_id)
+        # Формат данных проверен при PATCH по типу сессии: видео не подставить вместо фото
+        if file_type and session.file_type != file_type:
+            raise InvalidFileFormat
+        if session.offset != session.length:
+            raise UploadIncomplete(offset=session.offset, length=session.length)
+        return self.__data_path(upload_id)
+
+    def __remove(self, upload_id: UUID) -> None:
+        # Данные могли уже забрать в хранилище при завершении загрузки
+        for path in (self.__meta_path(upload_id), self.__data_path(upload_id)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    async def delete_session(self, upload_id: UUID, telegram_user_id: int) -> None:
+        # Только по метаданным: данные завершенной загрузки к этому моменту уже могли забрать в хранилище
+        meta = await asyncio.to_thread(self.__read_meta, upload_id)
+        if not meta or meta["telegram_user_id"] != telegram_user_id:
+            raise EntityNotFound(entity="upload", by_field="id")
+        await asyncio.to_thread(self.__remove, upload_id)
+
+    def __purge_expired(self) -> int:
+        deadline = time.time() - self.ttl
+        try:
+            entries = list(os.scandir(self.dir_path))
+        except FileNotFoundError:
+            return 0
+        mtimes: dict[str, float] = {}
+        for entry in entries:
+            stem = entry.name.removesuffix(".json")
+            try:
+                mtime = entry.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            mtimes[stem] = max(mtimes.get(stem, 0), mtime)
+
+        purged = 0
+        for stem, mtime in mtimes.items():
+            if mtime > deadline:
+                continue
+            try:
+                upload_id = UUID(hex=stem)
+            except ValueError:
+                continue
+            try:
+                data = open(self.__data_path(upload_id), "rb")
+            except FileNotFoundError:
+                self.__remove(upload_id)
+                purged += 1
+                continue
+            with data:
+                try:
+                    fcntl.flock(data, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # В сессию прямо сейчас пишут
+                    continue
+                self.__remove(upload_id)
+            purged += 1
+        return purged
+
+    async def purge_expired(self) -> int:
+        return await asyncio.to_thread(self.__purge_expired)
+
+    async def run_periodically(self, interval: float = settings.storage.upload_purge_interval) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                purged = await self.purge_expired()
+                if purged:
+                    logger.info("upload sessions: purged=%s", purged)
+            except Exception:
+                logger.exception("upload sessions purge failed")
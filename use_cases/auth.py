@@ -1,7 +1,11 @@
+import hashlib
+import hmac
+
 from db.repositories import UsersRepositoryProtocol
 from db.unit_of_work import UnitOfWorkProtocol
 from schemas.auth import TokensResponse, TokenData
 from services import AuthServiceProtocol, TelegramUtilsServiceProtocol
+from services.cache import TTLCache
 from typing_extensions import Protocol
 
 
@@ -14,12 +18,23 @@ class AuthUseCase:
     def __init__(self, auth_service: AuthServiceProtocol,
                  uof: UnitOfWorkProtocol,
                  telegram_utils_service: TelegramUtilsServiceProtocol,
+                 init_data_cache: TTLCache[str, tuple[bytes, TokensResponse]] | None = None
                  ):
         self.auth_service = auth_service
         self.telegram_utils_service = telegram_utils_service
         self.uof = uof
+        self.init_data_cache = init_data_cache
 
     async def create_tokens_by_telegram_init_data(self, telegram_init_data: str) -> TokensResponse:
+        # Повторный запрос с той же init_data (ретрай Mini App) - отдаем уже выданные токены
+        init_data_hash = None
+        init_data_digest = hashlib.sha256(telegram_init_data.encode()).digest()
+        if self.init_data_cache is not None:
+            init_data_hash = self.telegram_utils_service.get_init_data_hash(telegram_init_data)
+            cached = self.init_data_cache.get(init_data_hash) if init_data_hash else None
+            if cached and hmac.compare_digest(cached[0], init_data_digest):
+                return cached[1]
+
         # Верификация init_data
         user = await self.telegram_utils_service.verify_telegram_init_data(
             init_data=telegram_init_data
@@ -36,4 +51,6 @@ class AuthUseCase:
         tokens = await self.auth_service.create_tokens(token_data=TokenData(
             telegram_id=user.id, user_id=user_id
         ))
+        if init_data_hash:
+            self.init_data_cache.set(init_data_hash, (init_data_digest, tokens))
         return tokens
\ No newline at end of file
@@ -1,17 +1,28 @@
-from typing import Protocol
+import asyncio
+from typing import Protocol, AsyncIterable, Awaitable, Callable, TypeVar
 from uuid import UUID
 
+from config import settings
 from db.repositories import MediaCollectionsRepositoryProtocol
 from db.unit_of_work import UnitOfWorkProtocol
 from schemas.media_collections import (
     CreatedCollectionResponse, CreatedMediaBlockResponse,
-    MediaBlockPatches, CollectionResponse, MediaBlock
+    MediaBlockPatches, CollectionResponse, MediaBlock, CollectionsPage, MediaBlocksPage, CollectionChanges
 )
 from services import FileStorageServiceProtocol
 from services import TelegramUtilsServiceProtocol
+from exceptions.core import DuplicateMarker, EntityNotFound
+from services.bundle import TarBundle, build_collection_bundle
+from services.collection_cache import CollectionCacheProtocol
+from services.perceptual_hash import PhashIndex
+from services.photo_pipeline import PhotoPipelineServiceProtocol, DERIVATIVE_FIELDS, DERIVATIVE_URL_FIELDS
 from services.qr_code_service import QrCodeServiceProtocol
+from services.single_flight import SingleFlight
+from services.upload_sessions import UploadSessionServiceProtocol
 from urllib.parse import quote
 
+T = TypeVar("T")
+
 
 class MediaUseCaseProtocol(Protocol):
 
@@ -20,13 +31,27 @@ class MediaUseCaseProtocol(Protocol):
 
     async def add_media_block_to_collection(self,
                                             collection_uuid: UUID,
-                                            photo: bytes,
-                                            video: bytes,
+                                            photo: AsyncIterable[bytes],
+                                            video: AsyncIterable[bytes],
                                             telegram_user_id: int) -> CreatedMediaBlockResponse:
         ...
 
+    async def add_media_block_from_uploads(self,
+                                           collection_uuid: UUID,
+                                           photo_upload_id: UUID,
+                                           video_upload_id: UUID,
+                                           telegram_user_id: int) -> CreatedMediaBlockResponse:
+        ...
+
+    async def add_media_blocks_to_collection(self,
+                                             collection_uuid: UUID,
+                                             blocks: list[tuple[AsyncIterable[bytes], AsyncIterable[bytes]]],
+                                             telegram_user_id: int) -> list[CreatedMediaBlockResponse]:
+        ...
+
     async def patch_media_block(self, block_uuid: UUID, telegram_user_id: int,
-                                video: bytes | None = None, photo: bytes | None = None) -> None:
+                                video: AsyncIterable[bytes] | None = None,
+                                photo: AsyncIterable[bytes] | None = None) -> None:
         ...
 
     async def delete_collection(self, collection_uuid: UUID, telegram_user_id: int) -> None:
@@ -39,15 +64,30 @@ class MediaUseCaseProtocol(Protocol):
         ...
     async def get_collection(self, collection_uuid: UUID,
                              media_blocks_offset: int = 0,
-                             media_blocks_limit: int | None = None) -> CollectionResponse:
+                             media_blocks_limit: int | None = None,
+                             version: int | None = None) -> CollectionResponse:
+        ...
+
+    async def get_collection_version(self, collection_uuid: UUID) -> int:
         ...
 
     async def get_user_collections(self, telegram_user_id: int,
                                    offset: int = 0,
-                                   limit: int | None = None) -> list[CollectionResponse]:
+                                   limit: int | None = None,
+                                   cursor: str | None = None,
+                                   blocks_per_collection: int | None = None) -> CollectionsPage:
+        ...
+
+    async def get_collection_media_blocks(self, collection_uuid: UUID,
+                                          limit: int | None = None,
+                                          cursor: str | None = None,
+                                          version: int | None = None) -> MediaBlocksPage:
         ...
 
-    async def get_collection_media_blocks(self, collection_uuid: UUID) -> list[MediaBlock]:
+    async def get_collection_bundle(self, collection_uuid: UUID) -> TarBundle:
+        ...
+
+    async def get_collection_changes(self, collection_uuid: UUID, since: int = 0) -> CollectionChanges:
         ...
 
 class MediaUseCase(MediaUseCaseProtocol):
@@ -56,11 +96,43 @@ class MediaUseCase(MediaUseCaseProtocol):
                  uow: UnitOfWorkProtocol,
                  telegram_utils_service: TelegramUtilsServiceProtocol,
                  qr_code_service: QrCodeServiceProtocol,
+                 collection_cache: CollectionCacheProtocol | None = None,
+                 read_uow: UnitOfWorkProtocol | None = None,
+                 photo_pipeline: PhotoPipelineServiceProtocol | None = None,
+                 single_flight: SingleFlight | None = None,
+                 upload_sessions: UploadSessionServiceProtocol | None = None,
                  ):
         self.file_storage_service = file_storage_service
         self.uow: UnitOfWorkProtocol = uow
         self.telegram_utils_service = telegram_utils_service
         self.qr_code_service = qr_code_service
+        self.collection_cache = collection_cache
+        # Только для чтения: без коммита, может идти в реплику
+        self.read_uow: UnitOfWorkProtocol = read_uow or uow
+        self.photo_pipeline = photo_pipeline
+        # Общий на воркер: одновременные одинаковые чтения коллекции делят один запрос в базу
+        self.single_flight = single_flight
+        self.upload_sessions = upload_sessions
+
+    async def __load_shared(self, collection_uuid: UUID, key: str,
+                            loader: Callable[[UnitOfWorkProtocol], Awaitable[T]], cached: bool = True) -> T:
+        # Кеш коллекций, а перед ним - объединение одновременных одинаковых загрузок.
+        # Реплика (или основная база после записи) выбирается здесь, в контексте запроса, и входит в ключ:
+        # все чтения запроса идут в одну базу, а писавший запрос не получит чужой результат из реплики
+        uow = self.read_uow.pinned()
+
+        async def load() -> T:
+            if not cached or not self.collection_cache:
+                return await loader(uow)
+            return await self.collection_cache.get_or_load(collection_uuid, key, lambda: loader(uow))
+
+        if not self.single_flight:
+            return await load()
+        return await self.single_flight.do((collection_uuid, key, uow.source), load)
+
+    async def __invalidate_collection(self, collection_uuid: UUID) -> None:
+        if self.collection_cache:
+            await self.collection_cache.invalidate(collection_uuid)
 
     async def create_collection(self, telegram_user_id: int, name: str) -> CollectionResponse:
         async with self.uow as uow:
@@ -79,7 +151,8 @@ class MediaUseCase(MediaUseCaseProtocol):
 
             valid_name = quote(name)
             qr_code_url: str = await self.file_storage_service.save_file_get_url(
-                file=qr_code_bytes, filename=f"{telegram_user_id}-{valid_name}-qrcode"
+                file=qr_code_bytes,
+                filename=f"{telegram_user_id}-{valid_name}-qrcode.{self.qr_code_service.image_format}"
             )
 
             # Добавление ссылок к коллекции
@@ -98,102 +171,335 @@ class MediaUseCase(MediaUseCaseProtocol):
             qr_code_url=qr_code_url
         )
 
-    async def add_media_block_to_collection(self, collection_uuid: UUID,
-                                            photo: bytes,
-                                            video: bytes,
-                                            telegram_user_id: int) -> CreatedMediaBlockResponse:
-        photo_url: str = await self.file_storage_service.save_file_get_url(
-            file=photo, filename=self.file_storage_service.format_filename(
-                user_id=telegram_user_id, file_type=self.file_storage_service.file_types.photo
-            )
+    async def __save_media(self, telegram_user_id: int,
+                           **files: AsyncIterable[bytes]) -> dict[str, str]:
+        # Фото и видео пишутся на диск параллельно, кусками
+        file_types = self.file_storage_service.file_types
+        names = list(files)
+        results = await asyncio.gather(
+            *(
+                self.file_storage_service.save_stream_get_url(
+                    stream=files[name], file_type=file_types[name],
+                    filename=self.file_storage_service.format_filename(
+                        user_id=telegram_user_id, file_type=file_types[name]
+                    )
+                )
+                for name in names
+            ),
+            return_exceptions=True
         )
-        video_url: str = await self.file_storage_service.save_file_get_url(
-            file=video, filename=self.file_storage_service.format_filename(
-                user_id=telegram_user_id, file_type=self.file_storage_service.file_types.video
-            )
+        urls = {name: url for name, url in zip(names, results) if isinstance(url, str)}
+        error = next((r for r in results if isinstance(r, BaseException)), None)
+        if error:
+            # Не оставляем на диске файл, для которого не будет медиа-блока
+            await self.__delete_files(*urls.values())
+            raise error
+        return urls
+
+    @staticmethod
+    def __derivative_urls(values: dict[str, str | float | None]) -> list[str | None]:
+        return [values.get(field) for field in DERIVATIVE_URL_FIELDS]
+
+    async def __create_derivatives(self, urls: dict[str, str],
+                                   telegram_user_id: int) -> dict[str, str | float | None]:
+        # Превью и WebP для только что сохраненного фото. При ошибке удаляет и сами файлы из urls
+        if not self.photo_pipeline:
+            return dict.fromkeys(DERIVATIVE_FIELDS)
+        try:
+            return await self.photo_pipeline.create_derivatives(urls["photo"], telegram_user_id)
+        except BaseException:
+            await self.__delete_files(*urls.values())
+            raise
+
+    @staticmethod
+    async def __find_similar_markers(uow: UnitOfWorkProtocol, phashes: list[int | None],
+                                     collection_uuid: UUID | None = None,
+                                     media_block_uuid: UUID | None = None) -> list[UUID | int | None]:
+        # Для каждого нового фото - похожий блок коллекции (uuid) или более раннее фото
+        # этой же загрузки (его номер), если расстояние не больше duplicate_marker_distance
+        policy = settings.photo_pipeline.duplicate_marker_policy
+        if policy == "off" or all(value is None for value in phashes):
+            return [None] * len(phashes)
+
+        rows = await uow.media_collections.get_marker_hashes(
+            collection_uuid=collection_uuid, media_block_uuid=media_block_uuid
         )
-        async with self.uow as uow:
-            block_uuid: UUID = await uow.media_collections.add_media_block_to_collection(
-                collection_uuid=collection_uuid, telegram_user_id=telegram_user_id,
-                photo_url=photo_url, video_url=video_url
+        index: PhashIndex[UUID | int] = PhashIndex(
+            (value for _, value in rows), (block_uuid for block_uuid, _ in rows)
+        )
+        similar = []
+        for i, value in enumerate(phashes):
+            match = index.nearest(value) if value is not None else None
+            if match and match[1] <= settings.photo_pipeline.duplicate_marker_distance:
+                if policy == "reject":
+                    raise DuplicateMarker(
+                        similar_block_id=match[0] if isinstance(match[0], UUID) else None, distance=match[1]
+                    )
+                similar.append(match[0])
+            else:
+                similar.append(None)
+            if value is not None:
+                index.add(value, i)
+        return similar
+
+    async def __delete_files(self, *urls: str | None) -> None:
+        for url in urls:
+            if not url:
+                continue
+            try:
+                await self.file_storage_service.delete_file_by_url(url=url)
+            except FileNotFoundError:
+                pass
+
+    async def __link_uploads(self, telegram_user_id: int, paths: dict[str, str]) -> dict[str, str]:
+        # Завершенные загрузки попадают в хранилище жесткой ссылкой, без повторной записи.
+        # Данные сессий при этом не трогаются: удалить сессии можно только после коммита блока
+        file_types = self.file_storage_service.file_types
+        names = list(paths)
+        results = await asyncio.gather(
+            *(
+                self.file_storage_service.save_local_file_get_url(
+                    path=paths[name], file_type=file_types[name],
+                    filename=self.file_storage_service.format_filename(
+                        user_id=telegram_user_id, file_type=file_types[name]
+                    )
+                )
+                for name in names
+            ),
+            return_exceptions=True
+        )
+        urls = {name: url for name, url in zip(names, results) if isinstance(url, str)}
+        error = next((r for r in results if isinstance(r, BaseException)), None)
+        if error:
+            await self.__delete_files(*urls.values())
+            # Сессию успели удалить (по сроку или повторным запросом) - для клиента это несуществующая загрузка
+            raise EntityNotFound(entity="upload", by_field="id") if isinstance(error, FileNotFoundError) else error
+        return urls
+
+    async def add_media_block_to_collection(self, collection_uuid: UUID,
+                                            photo: AsyncIterable[bytes],
+                                            video: AsyncIterable[bytes],
+                                            telegram_user_id: int) -> CreatedMediaBlockResponse:
+        urls = await self.__save_media(telegram_user_id, photo=photo, video=video)
+        derivatives = await self.__create_derivatives(urls, telegram_user_id)
+        return await self.__add_saved_media_block(collection_uuid, telegram_user_id, urls, derivatives)
+
+    async def add_media_block_from_uploads(self, collection_uuid: UUID,
+                                           photo_upload_id: UUID,
+                                           video_upload_id: UUID,
+                                           telegram_user_id: int) -> CreatedMediaBlockResponse:
+        file_types = self.file_storage_service.file_types
+        upload_ids = dict(photo=photo_upload_id, video=video_upload_id)
+        # Сначала все, что может отклонить блок, - по файлам сессий, пока они еще не в хранилище.
+        # При любой ошибке загрузки остаются целыми, и клиенту не нужно заново отправлять большое видео
+        paths = {
+            name: await self.upload_sessions.get_completed_path(
+                upload_id, telegram_user_id, file_type=file_types[name]
             )
+            for name, upload_id in upload_ids.items()
+        }
+        derivatives = dict.fromkeys(DERIVATIVE_FIELDS)
+        if self.photo_pipeline:
+            derivatives = await self.photo_pipeline.create_derivatives_from_path(paths["photo"], telegram_user_id)
+        try:
+            urls = await self.__link_uploads(telegram_user_id, paths)
+        except BaseException:
+            await self.__delete_files(*self.__derivative_urls(derivatives))
+            raise
+        block = await self.__add_saved_media_block(collection_uuid, telegram_user_id, urls, derivatives)
+
+        for upload_id in upload_ids.values():
+            try:
+                await self.upload_sessions.delete_session(upload_id, telegram_user_id)
+            except EntityNotFound:
+                pass
+        return block
+
+    async def __add_saved_media_block(self, collection_uuid: UUID, telegram_user_id: int, urls: dict[str, str],
+                                      derivatives: dict[str, str | float | None]) -> CreatedMediaBlockResponse:
+        # При ошибке удаляет и файлы блока, и производные
+        photo_url, video_url = urls["photo"], urls["video"]
+        try:
+            async with self.uow as uow:
+                similar, = await self.__find_similar_markers(
+                    uow, [derivatives.get("photo_phash")], collection_uuid=collection_uuid
+                )
+                block_uuid: UUID = await uow.media_collections.add_media_block_to_collection(
+                    collection_uuid=collection_uuid, telegram_user_id=telegram_user_id,
+                    photo_url=photo_url, video_url=video_url, derivatives=derivatives
+                )
+        except BaseException:
+            await self.__delete_files(photo_url, video_url, *self.__derivative_urls(derivatives))
+            raise
+        await self.__invalidate_collection(collection_uuid)
         return CreatedMediaBlockResponse(
             photo_url=photo_url,
             video_url=video_url,
-            id=block_uuid
+            id=block_uuid,
+            similar_block_id=similar,
+            **derivatives
+        )
+
+    async def add_media_blocks_to_collection(self, collection_uuid: UUID,
+                                             blocks: list[tuple[AsyncIterable[bytes], AsyncIterable[bytes]]],
+                                             telegram_user_id: int) -> list[CreatedMediaBlockResponse]:
+        # Пары пишутся параллельно, но не больше upload_concurrency пар одновременно
+        semaphore = asyncio.Semaphore(settings.storage.upload_concurrency)
+
+        async def save_pair(photo: AsyncIterable[bytes],
+                            video: AsyncIterable[bytes]) -> dict[str, str | float | None]:
+            async with semaphore:
+                urls = await self.__save_media(telegram_user_id, photo=photo, video=video)
+                derivatives = await self.__create_derivatives(urls, telegram_user_id)
+                return dict(photo_url=urls["photo"], video_url=urls["video"], **derivatives)
+
+        results = await asyncio.gather(
+            *(save_pair(photo, video) for photo, video in blocks), return_exceptions=True
         )
+        saved = [block for block in results if isinstance(block, dict)]
+        stored_urls = [
+            url for block in saved for url in (block["photo_url"], block["video_url"], *self.__derivative_urls(block))
+        ]
+        error = next((r for r in results if isinstance(r, BaseException)), None)
+        if error:
+            await self.__delete_files(*stored_urls)
+            raise error
+
+        try:
+            async with self.uow as uow:
+                similar = await self.__find_similar_markers(
+                    uow, [block.get("photo_phash") for block in saved], collection_uuid=collection_uuid
+                )
+                block_uuids = await uow.media_collections.add_media_blocks_to_collection(
+                    collection_uuid=collection_uuid, telegram_user_id=telegram_user_id,
+                    blocks=saved
+                )
+        except BaseException:
+            await self.__delete_files(*stored_urls)
+            raise
+        await self.__invalidate_collection(collection_uuid)
+        return [
+            CreatedMediaBlockResponse(
+                id=block_uuid, **block,
+                similar_block_id=block_uuids[similar_] if isinstance(similar_, int) else similar_
+            )
+            for block, block_uuid, similar_ in zip(saved, block_uuids, similar)
+        ]
 
     async def patch_media_block(self, block_uuid: UUID, telegram_user_id: int,
-                                video: bytes | None = None, photo: bytes | None = None) -> None:
-        updates = {}
+                                video: AsyncIterable[bytes] | None = None,
+                                photo: AsyncIterable[bytes] | None = None) -> None:
+        files = {}
         if video:
-            video_url = await self.file_storage_service.save_file_get_url(
-                file=video, filename=self.file_storage_service.format_filename(
-                user_id=telegram_user_id, file_type=self.file_storage_service.file_types.video
-            )
-            )
-            updates.update(video_url=video_url)
+            files.update(video=video)
         if photo:
-            photo_url = await self.file_storage_service.save_file_get_url(
-                file=photo, filename=self.file_storage_service.format_filename(
-                user_id=telegram_user_id, file_type=self.file_storage_service.file_types.photo
-            )
-            )
-            updates.update(photo_url=photo_url)
+            files.update(photo=photo)
+        urls = await self.__save_media(telegram_user_id, **files)
+        updates = {f'{name}_url': url for name, url in urls.items()}
+        if photo:
+            updates.update(await self.__create_derivatives(urls, telegram_user_id))
 
         # Получение и добавление обновлений
-        async with self.uow as uow:
-            block = await uow.media_collections.get_media_block(media_block_uuid=block_uuid)
-            await uow.media_collections.update_media_block(
-                media_block_uuid=block_uuid, telegram_user_id=telegram_user_id,
-                updates=updates
-            )
+        try:
+            async with self.uow as uow:
+                block = await uow.media_collections.get_media_block(media_block_uuid=block_uuid)
+                if photo:
+                    await self.__find_similar_markers(
+                        uow, [updates.get("photo_phash")], media_block_uuid=block_uuid
+                    )
+                collection_uuid = await uow.media_collections.update_media_block(
+                    media_block_uuid=block_uuid, telegram_user_id=telegram_user_id,
+                    updates=updates
+                )
+        except BaseException:
+            await self.__delete_files(*urls.values(), *self.__derivative_urls(updates))
+            raise
+        await self.__invalidate_collection(collection_uuid)
 
         # Удалить прошлые картинку и видео
         if video:
             await self.file_storage_service.delete_file_by_url(url=block.video_url)
         if photo:
             await self.file_storage_service.delete_file_by_url(url=block.photo_url)
+            await self.__delete_files(*self.__derivative_urls(block.model_dump()))
 
     async def delete_collection(self, collection_uuid: UUID, telegram_user_id: int) -> None:
         async with self.uow as uow:
             await uow.media_collections.delete_collection(
                 collection_uuid, telegram_user_id
             )
+        await self.__invalidate_collection(collection_uuid)
 
     async def delete_media_block(self, block_uuid: UUID, telegram_user_id: int) -> None:
         async with self.uow as uow:
-            await uow.media_collections.delete_media_block(
+            collection_uuid = await uow.media_collections.delete_media_block(
                 media_block_uuid=block_uuid, telegram_user_id=telegram_user_id
             )
+        await self.__invalidate_collection(collection_uuid)
 
     async def update_collection_name(self, collection_uuid: UUID, telegram_user_id: int, name: str) -> None:
         async with self.uow as uow:
             await uow.media_collections.update_collection_name(
                 collection_uuid, telegram_user_id, name
             )
+        await self.__invalidate_collection(collection_uuid)
 
     async def get_collection(self, collection_uuid: UUID,
                              media_blocks_offset: int = 0,
-                             media_blocks_limit: int | None = None) -> CollectionResponse:
-        async with self.uow as uow:
-            collection = await uow.media_collections.get_collection(
-                collection_uuid=collection_uuid,
-                media_blocks_offset=media_blocks_offset,
-                media_blocks_limit=media_blocks_limit
-            )
-        return collection
+                             media_blocks_limit: int | None = None,
+                             version: int | None = None) -> CollectionResponse:
+        # version - уже известная версия коллекции: с ней в ключе закешированный ответ
+        # соответствует ETag, даже если кеш другого воркера еще не инвалидирован
+        async def load(read_uow: UnitOfWorkProtocol) -> CollectionResponse:
+            async with read_uow as uow:
+                return await uow.media_collections.get_collection(
+                    collection_uuid=collection_uuid,
+                    media_blocks_offset=media_blocks_offset,
+                    media_blocks_limit=media_blocks_limit
+                )
+
+        return await self.__load_shared(
+            collection_uuid, f'full:{version}:{media_blocks_offset}:{media_blocks_limit}', load
+        )
+
+    async def get_collection_version(self, collection_uuid: UUID) -> int:
+        # Проверка ETag на каждом GET: общая для одновременных запросов, но не кешируется.
+        # Кеш в памяти инвалидируется только в воркере, который писал, а после ревалидации
+        # клиент должен получить свежую версию от любого воркера
+        async def load(read_uow: UnitOfWorkProtocol) -> int:
+            async with read_uow as uow:
+                return await uow.media_collections.get_collection_version(collection_uuid)
+
+        return await self.__load_shared(collection_uuid, 'version', load, cached=False)
 
     async def get_user_collections(self, telegram_user_id: int,
-                                   offset: int = 0, limit: int | None = None) -> list[CollectionResponse]:
-        async with self.uow as uow:
+                                   offset: int = 0, limit: int | None = None,
+                                   cursor: str | None = None,
+                                   blocks_per_collection: int | None = None) -> CollectionsPage:
+        async with self.read_uow as uow:
             collections = await uow.media_collections.get_collections_by_user(
                 telegram_user_id=telegram_user_id,
-                offset=offset, limit=limit
+                offset=offset, limit=limit, cursor=cursor,
+                blocks_per_collection=blocks_per_collection
             )
         return collections
 
-    async def get_collection_media_blocks(self, collection_uuid: UUID) -> list[MediaBlock]:
-        async with self.uow as uow:
-            blocks = await uow.media_collections.get_collection_media_block(collection_uuid)
-        return blocks
\ No newline at end of file
+    async def get_collection_media_blocks(self, collection_uuid: UUID,
+                                          limit: int | None = None,
+                                          cursor: str | None = None,
+                                          version: int | None = None) -> MediaBlocksPage:
+        async def load(read_uow: UnitOfWorkProtocol) -> MediaBlocksPage:
+            async with read_uow as uow:
+                return await uow.media_collections.get_collection_media_block(
+                    collection_uuid, limit=limit, cursor=cursor
+                )
+
+        return await self.__load_shared(collection_uuid, f'blocks:{version}:{limit}:{cursor}', load)
+
+    async def get_collection_bundle(self, collection_uuid: UUID) -> TarBundle:
+        collection = await self.get_collection(collection_uuid)
+        return await build_collection_bundle(collection, self.file_storage_service)
+
+    async def get_collection_changes(self, collection_uuid: UUID, since: int = 0) -> CollectionChanges:
+        async with self.read_uow as uow:
+            return await uow.media_collections.get_collection_changes(collection_uuid, since=since)